@@ -0,0 +1,62 @@
+"""
+Measure aggregate decode throughput of the batched engine under concurrency.
+
+Runs the transcript prompts through a single model context one at a time, then through the
+batched engine with growing numbers of concurrent requests. Run from the src folder:
+
+    python -m benchmarks.batching --concurrency 1 4 8 16
+"""
+from pathlib import Path
+import argparse
+import json
+import time
+
+import setup_llama
+from benchmarks.prompts import DEFAULT_TRANSCRIPTS, load_prompts
+from inference.batching import BatchedEngine
+
+def single_stream(prompts, max_tokens: int):
+    model = setup_llama.setup_model(speculative="none")
+    started = time.perf_counter()
+    tokens = sum(model(prompt, max_tokens=max_tokens)["usage"]["completion_tokens"] for prompt in prompts)
+    seconds = time.perf_counter() - started
+    model.close()
+    return {"concurrency": 1, "engine": "single", "completion_tokens": tokens, "tokens_per_second": tokens / seconds}
+
+def batched(engine: BatchedEngine, prompts, concurrency: int, max_tokens: int):
+    requests = (prompts * (concurrency // len(prompts) + 1))[:max(concurrency, len(prompts))]
+    started = time.perf_counter()
+    futures = [engine.submit_generation(prompt, max_tokens) for prompt in requests]
+    tokens = sum(future.result()["usage"]["completion_tokens"] for future in futures)
+    seconds = time.perf_counter() - started
+    return {"concurrency": concurrency, "engine": "batched", "completion_tokens": tokens, "tokens_per_second": tokens / seconds}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcripts", default=DEFAULT_TRANSCRIPTS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.transcripts)
+    results = [single_stream(prompts, args.max_tokens)]
+    for concurrency in args.concurrency:
+        # One sequence per concurrent request, so every request decodes in the same batch
+        model, context = setup_llama.setup_batched_model(concurrency)
+        engine = BatchedEngine(model, context, queue_size=max(concurrency, len(prompts)))
+        results.append(batched(engine, prompts, concurrency, args.max_tokens))
+        engine.shutdown()
+
+    baseline = results[0]["tokens_per_second"]
+    print(f"{'engine':<10}{'concurrency':>12}{'tokens':>8}{'tok/s':>10}{'speedup':>9}")
+    for result in results:
+        print(f"{result['engine']:<10}{result['concurrency']:>12}{result['completion_tokens']:>8}"
+              f"{result['tokens_per_second']:>10.1f}{result['tokens_per_second'] / baseline:>9.2f}")
+
+    if args.output:
+        with Path(args.output).open("w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
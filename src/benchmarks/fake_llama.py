@@ -0,0 +1,156 @@
+"""
+Deterministic stand-in for llama_cpp.Llama, for benchmarking the code around the model.
+
+FakeLlama implements the part of the Llama interface the app uses: tokenizing, completions with
+and without streaming, stop sequences, saved states and the prefix reuse of the KV cache. The
+same prompt always gives the same completion, and the cost of the model is simulated with a
+fixed delay per evaluated prompt token and per generated token.
+"""
+import json
+import re
+import threading
+import time
+
+import numpy as np
+from llama_cpp import Llama, LlamaState
+
+# Special tokens, words with their leading space, digits and single other characters, roughly the granularity of BPE
+TOKEN_PATTERN = re.compile(r"<\|[a-z_]+\|>| ?[A-Za-z]+| ?\d|\s+|.", re.DOTALL)
+BOS_TOKEN = 1
+
+REPLY = (
+    "Thank you for your answer. You explained the main steps clearly and gave a concrete example from "
+    "your last project. Next question: how do you make sure an API stays backwards compatible when "
+    "the data model changes, and how would you test that? "
+)
+SUMMARY = {
+    "feedback": "Good answer, you covered the trade-offs.",
+    "strengths": ["Clear structure", "Concrete examples"],
+    "improvements": ["Mention testing earlier"],
+    "overall": "A solid interview.",
+}
+QUESTION_BANK = {
+    "questions": [
+        {"question": "How would you design a REST API for a service that many teams depend on?", "relevance": 5},
+        {"question": "Describe how you track down a slow database query in production.", "relevance": 4},
+        {"question": "How do you decide what to cover with unit tests and what with integration tests?", "relevance": 4},
+        {"question": "Tell me about a time you had to change a design late in a project.", "relevance": 3},
+    ],
+}
+
+class Vocabulary:
+    """Token ids assigned in order of first appearance, shared by every FakeLlama so they all agree."""
+
+    def __init__(self):
+        self.ids = {"<|begin_of_text|>": BOS_TOKEN}
+        self.pieces = ["", "<|begin_of_text|>"]
+        self.lock = threading.Lock()
+
+    def token(self, piece: str) -> int:
+        token = self.ids.get(piece)
+        if token is None:
+            with self.lock:
+                token = self.ids.setdefault(piece, len(self.pieces))
+                if token == len(self.pieces):
+                    self.pieces.append(piece)
+        return token
+
+vocabulary = Vocabulary()
+
+class FakeLlama:
+    """
+    Answers every prompt with the same reply. With a grammar it writes the question bank JSON for
+    question bank prompts and the interview summary JSON otherwise.
+    """
+
+    def __init__(self, n_ctx: int = 4096, prompt_token_delay: float = 0.0, token_delay: float = 0.0,
+                 reply_tokens: int = 64):
+        self._n_ctx = n_ctx
+        self.prompt_token_delay = prompt_token_delay
+        self.token_delay = token_delay
+        self.reply_tokens = reply_tokens
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.n_tokens = 0
+
+    longest_token_prefix = staticmethod(Llama.longest_token_prefix)
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+        tokens = [BOS_TOKEN] if add_bos else []
+        return tokens + [vocabulary.token(piece) for piece in TOKEN_PATTERN.findall(text.decode("utf-8", errors="ignore"))]
+
+    def detokenize(self, tokens, prev_tokens=None, special: bool = False) -> bytes:
+        return "".join(vocabulary.pieces[token] for token in tokens if token != BOS_TOKEN).encode("utf-8")
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        time.sleep(self.prompt_token_delay * len(tokens))
+        self.input_ids[self.n_tokens:self.n_tokens + len(tokens)] = tokens
+        self.n_tokens += len(tokens)
+
+    def save_state(self) -> LlamaState:
+        return LlamaState(self.input_ids.copy(), np.zeros((1, 1), dtype=np.single), self.n_tokens, b"", 0, 0)
+
+    def load_state(self, state: LlamaState):
+        self.input_ids = state.input_ids.copy()
+        self.n_tokens = state.n_tokens
+
+    def close(self):
+        pass
+
+    def __call__(self, prompt: str, max_tokens: int = 16, stop=None, grammar=None, stream: bool = False, **kwargs):
+        tokens = self.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+        # Like Llama, keep the evaluated prefix and evaluate at least the last prompt token again
+        prefix = min(self.longest_token_prefix(self.input_ids[:self.n_tokens], tokens), len(tokens) - 1)
+        self.n_tokens = prefix
+        self.eval(tokens[prefix:])
+        stopping_criteria = kwargs.get("stopping_criteria")
+        # Structured output is either a question bank or the interview summary, each yielded once
+        if grammar is not None:
+            structured = QUESTION_BANK if "Rate the relevance of each question" in prompt else SUMMARY
+            chunks = self.generate_chunks(json.dumps(structured), None, max_tokens, stop, stopping_criteria)
+        else:
+            chunks = self.generate_chunks(REPLY, self.reply_tokens, max_tokens, stop, stopping_criteria)
+        if stream:
+            return chunks
+        text, finish_reason = "", None
+        for chunk in chunks:
+            text += chunk["choices"][0]["text"]
+            finish_reason = chunk["choices"][0]["finish_reason"] or finish_reason
+        completion_tokens = len(self.tokenize(text.encode("utf-8"), add_bos=False))
+        return {
+            "choices": [{"text": text, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": len(tokens), "completion_tokens": completion_tokens,
+                      "total_tokens": len(tokens) + completion_tokens},
+        }
+
+    def generate_chunks(self, completion: str, length, max_tokens: int, stop, stopping_criteria=None):
+        """Stream the completion token by token, repeated up to length tokens if given, like Llama(stream=True)."""
+        pieces = TOKEN_PATTERN.findall(completion)
+        stop = [s for s in (stop or []) if s]
+        text = ""
+        finish_reason = "stop"
+        for index in range(length or len(pieces)):
+            if index >= max_tokens or self.n_tokens >= self._n_ctx:
+                finish_reason = "length"
+                break
+            time.sleep(self.token_delay)
+            if stopping_criteria is not None and stopping_criteria(self.input_ids[:self.n_tokens], None):
+                break
+            piece = pieces[index % len(pieces)]
+            self.input_ids[self.n_tokens] = vocabulary.token(piece)
+            self.n_tokens += 1
+            candidate = text + piece
+            ends = [candidate.find(s) for s in stop if s in candidate]
+            if ends:
+                piece = candidate[len(text):min(ends)]
+                if piece:
+                    yield {"choices": [{"text": piece, "finish_reason": None}]}
+                break
+            text = candidate
+            yield {"choices": [{"text": piece, "finish_reason": None}]}
+        yield {"choices": [{"text": "", "finish_reason": finish_reason}]}
@@ -0,0 +1,307 @@
+"""
+Measure the cost of the chat pipeline around the model, offline.
+
+The model is replaced by FakeLlama (benchmarks/fake_llama.py) with a fixed delay per token, and
+Keycloak and MariaDB by stubs, so neither a GGUF file nor running services are needed. Over
+conversations of growing length the benchmark reports
+
+  - the time of the single steps of a turn: build_llama3_prompt, get_system_prompt, the response
+    filter, parsing the interview summary and a whole prompt_model_static turn
+  - requests per second and p50/p99 latency of POST /chat through the FastAPI app, with several
+    conversations running at the same time
+
+Every run is appended to a history file together with the git commit and compared with the last
+run with the same parameters, so regressions show up. Run from the src folder:
+
+    python -m benchmarks.pipeline --turns 1 5 10 20 --concurrency 4 --token-delay 0.002
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import copy
+import datetime
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import types
+
+from benchmarks.fake_llama import FakeLlama, REPLY, SUMMARY, TOKEN_PATTERN
+from prompt.history import Turn, USER, ASSISTANT, JOB_DESCRIPTION as JOB_DESCRIPTION_ROLE
+
+DEFAULT_HISTORY = "benchmarks/results/pipeline.jsonl"
+JOB_DESCRIPTION = ("We are looking for a Python Backend Developer. Responsibilities: design REST APIs with FastAPI, "
+                   "model data in MariaDB and deploy services with Docker.")
+USER_TURNS = (
+    "I designed a REST API for an order service with FastAPI and split it into routers per resource.",
+    "I version the endpoints and only add optional fields, removed fields stay for one release.",
+    "We test the old clients against the new API in CI with recorded requests.",
+    "For slow queries I look at the query plan first and add the missing index.",
+)
+
+# Settings that keep the app offline. Nothing listens on the Keycloak URL, so the client gives up at import
+OFFLINE_ENVIRONMENT = {
+    "DB_NAME": "benchmark",
+    "DB_USER": "benchmark",
+    "DB_USER_PASSWORD": "benchmark",
+    "KEYCLOAK_SERVER_URL": "http://127.0.0.1:9",
+    "KEYCLOAK_REALM": "benchmark",
+    "KEYCLOAK_CLIENT_ID": "benchmark",
+    "KEYCLOAK_CLIENT_SECRET": "benchmark",
+    "KEYCLOAK_ADMIN_USERNAME": "benchmark",
+    "KEYCLOAK_ADMIN_PASSWORD": "benchmark",
+    # FakeLlama stands in for Llama, the batched engine drives the llama context directly
+    "LLAMA_BATCHED_SEQUENCES": "0",
+    # Every conversation sends the same turns, cached responses would skip the pipeline
+    "RESPONSE_CACHE_MODES": "",
+}
+
+class StubDatabase:
+    """Keeps the rows the app writes in memory instead of MariaDB."""
+
+    def __init__(self):
+        self.chat_messages = []
+        self.job_descriptions = []
+        self.question_banks = {}
+
+    def save_chat_message(self, session_id: str, sender: str, message: str):
+        self.chat_messages.append((session_id, sender, message))
+
+    def get_recent_conversation(self, session_id: str, max_messages: int):
+        job_details = [details for stored_id, _, details, _ in self.job_descriptions if stored_id == session_id]
+        messages = [(sender, message) for stored_id, sender, message in self.chat_messages if stored_id == session_id]
+        return (job_details[-1] if job_details else None), messages[-max_messages:]
+
+    def create_job_description(self, session_id: str, job_title: str, job_details: str, job_url: str = None):
+        self.job_descriptions.append((session_id, job_title, job_details, job_url))
+
+    def save_question_bank(self, job_key: str, questions: list):
+        self.question_banks[job_key] = list(questions)
+
+    def get_question_bank(self, job_key: str):
+        return list(self.question_banks.get(job_key, []))
+
+def install_offline_environment():
+    """Settings and driver the app modules need at import, without the services they point at."""
+    os.environ.update(OFFLINE_ENVIRONMENT)
+    if "mariadb" not in sys.modules and importlib.util.find_spec("mariadb") is None:
+        # The driver needs the MariaDB connector library, which the stub database does not use
+        sys.modules["mariadb"] = types.SimpleNamespace(
+            Error=Exception, Connection=object, ConnectionPool=None, connect=None
+        )
+
+def install_stubs(args):
+    """Point the app at FakeLlama and the stubs. Has to run before the app modules are imported."""
+    install_offline_environment()
+
+    import setup_llama
+    setup_llama.setup_model = lambda *_, **__: FakeLlama(
+        setup_llama.llama_settings.LLAMA_N_CTX, args.prompt_token_delay, args.token_delay, args.reply_tokens
+    )
+    setup_llama.setup_tokenizer = lambda: FakeLlama(setup_llama.llama_settings.LLAMA_N_CTX)
+
+    from authentication.auth_controller import AuthController
+    from models import UserInfo
+    user = UserInfo(preferred_username="benchmark", email="benchmark@example.com")
+    AuthController.protected_endpoint = staticmethod(lambda credentials=None: user)
+
+    import database.chat_history
+    import database.job_description
+    import database.question_bank
+    import main
+    database_stub = StubDatabase()
+    main.save_chat_message = database_stub.save_chat_message
+    database.chat_history.get_recent_conversation = database_stub.get_recent_conversation
+    database.job_description.create_job_description = database_stub.create_job_description
+    database.question_bank.save_question_bank = database_stub.save_question_bank
+    database.question_bank.get_question_bank = database_stub.get_question_bank
+    # main configures debug logging for every request, which would dominate the timings
+    logging.getLogger().setLevel(args.log_level)
+    return main
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+def summarize(durations) -> dict:
+    return {
+        "count": len(durations),
+        "p50_ms": percentile(durations, 50) * 1000,
+        "p99_ms": percentile(durations, 99) * 1000,
+    }
+
+def time_calls(fn, repeat: int, setup=None) -> dict:
+    durations = []
+    for _ in range(repeat):
+        arguments = setup() if setup is not None else ()
+        started = time.perf_counter()
+        fn(*arguments)
+        durations.append(time.perf_counter() - started)
+    return summarize(durations)
+
+def build_session(g, session_id: str, turns: int):
+    """Session in training mode with turns finished exchanges in its history."""
+    session = g.get_chat_history(session_id)
+    session["job_description"] = JOB_DESCRIPTION
+    session["mode"] = "training"
+    session["history"].append(Turn(JOB_DESCRIPTION_ROLE, JOB_DESCRIPTION))
+    session["history"].append(Turn(USER, "/training"))
+    for turn in range(turns):
+        session["history"].append(Turn(USER, USER_TURNS[turn % len(USER_TURNS)]))
+        session["history"].append(Turn(ASSISTANT, REPLY.strip()))
+    return session
+
+def benchmark_steps(turns: int, repeat: int):
+    import get_model_response as g
+    from prompt.prompt import get_system_prompt
+    from prompt.output_filter import ResponseFilter
+    from prompt.profiles import parse_interview_summary, format_interview_summary
+
+    session = build_session(g, f"steps-{turns}", turns)
+    user_input = USER_TURNS[turns % len(USER_TURNS)]
+    pieces = TOKEN_PATTERN.findall(REPLY)
+    summary = json.dumps(SUMMARY)
+
+    def filter_reply():
+        output_filter = ResponseFilter()
+        for piece in pieces:
+            output_filter.feed(piece)
+        output_filter.finish()
+
+    def copy_session():
+        # Every turn appends to the history, so each repetition starts from its own copy
+        session_id = f"turn-{turns}-{time.perf_counter_ns()}"
+        g.chat_sessions[session_id] = copy.deepcopy(session)
+        return session_id, user_input
+
+    steps = {
+        "build_llama3_prompt": time_calls(lambda: g.build_llama3_prompt(session, user_input), repeat),
+        "get_system_prompt": time_calls(lambda: get_system_prompt(user_input), repeat),
+        "response_filter": time_calls(filter_reply, repeat),
+        "interview_summary": time_calls(lambda: format_interview_summary(parse_interview_summary(summary)), repeat),
+        "prompt_model_static": time_calls(g.prompt_model_static, max(1, repeat // 10), copy_session),
+    }
+    return [{"step": step, "turns": turns, **result} for step, result in steps.items()]
+
+async def run_conversation(client, session_id: str, turns: int, latencies, errors):
+    headers = {"Authorization": "Bearer benchmark"}
+    # Job description and mode selection set up the session, only the turns after them are measured
+    for user_input in (JOB_DESCRIPTION, "/training"):
+        await client.post("/chat", json={"sessionId": session_id, "userInput": user_input}, headers=headers)
+    for turn in range(turns):
+        started = time.perf_counter()
+        response = await client.post(
+            "/chat", json={"sessionId": session_id, "userInput": USER_TURNS[turn % len(USER_TURNS)]}, headers=headers
+        )
+        if response.status_code != 200:
+            errors.append(response.status_code)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+async def benchmark_load(app, turns: int, concurrency: int):
+    import httpx
+    latencies, errors = [], []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_conversation(client, f"load-{turns}-{client_id}-{time.time_ns()}", turns, latencies, errors)
+            for client_id in range(concurrency)
+        ))
+        seconds = time.perf_counter() - started
+    result = {"turns": turns, "concurrency": concurrency, "errors": len(errors), "requests_per_second": 0.0}
+    if latencies:
+        result.update(summarize(latencies))
+        result["requests_per_second"] = len(latencies) / seconds
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous_run(history: Path, parameters: dict):
+    if not history.exists():
+        return None
+    previous = None
+    with history.open("r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                run = json.loads(line)
+                if run["parameters"] == parameters:
+                    previous = run
+    return previous
+
+def change(current: float, before) -> str:
+    if not before:
+        return ""
+    return f"{(current / before - 1) * 100:+.0f}%"
+
+def report(run: dict, previous):
+    before_steps = {(s["step"], s["turns"]): s for s in previous["steps"]} if previous else {}
+    before_load = {r["turns"]: r for r in previous["load"]} if previous else {}
+    if previous:
+        print(f"Compared with the run of {previous['timestamp']} (commit {previous['commit']})")
+    print(f"{'step':<22}{'turns':>6}{'p50 ms':>10}{'p99 ms':>10}{'p50 change':>12}")
+    for step in run["steps"]:
+        before = before_steps.get((step["step"], step["turns"]), {})
+        print(f"{step['step']:<22}{step['turns']:>6}{step['p50_ms']:>10.3f}{step['p99_ms']:>10.3f}"
+              f"{change(step['p50_ms'], before.get('p50_ms')):>12}")
+    print()
+    print(f"{'turns':>6}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'req/s change':>14}")
+    for result in run["load"]:
+        before = before_load.get(result["turns"], {})
+        print(f"{result['turns']:>6}{result.get('count', 0):>10}{result['errors']:>8}{result['requests_per_second']:>9.1f}"
+              f"{result.get('p50_ms', 0):>10.1f}{result.get('p99_ms', 0):>10.1f}"
+              f"{change(result['requests_per_second'], before.get('requests_per_second')):>14}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, nargs="+", default=[1, 5, 10, 20], help="Conversation lengths to measure")
+    parser.add_argument("--concurrency", type=int, default=4, help="Conversations sent to /chat at the same time")
+    parser.add_argument("--repeat", type=int, default=200, help="Repetitions of every single step")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds the fake model takes per generated token")
+    parser.add_argument("--prompt-token-delay", type=float, default=0.0, help="Seconds per evaluated prompt token")
+    parser.add_argument("--reply-tokens", type=int, default=64, help="Length of the fake model's answers")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON lines file the results are appended to")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    main_module = install_stubs(args)
+    import get_model_response as g
+    g.load_models()
+    if g.model_status() != "ready":
+        raise SystemExit(f"Model stand-in failed to load: {g.model_load_error}")
+
+    parameters = {
+        "turns": args.turns,
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        "token_delay": args.token_delay,
+        "prompt_token_delay": args.prompt_token_delay,
+        "reply_tokens": args.reply_tokens,
+        "workers": g.settings.LLAMA_WORKERS,
+    }
+    steps = [step for turns in args.turns for step in benchmark_steps(turns, args.repeat)]
+    load = [asyncio.run(benchmark_load(main_module.app, turns, args.concurrency)) for turns in args.turns]
+    run = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "parameters": parameters,
+        "steps": steps,
+        "load": load,
+    }
+
+    history = Path(args.history)
+    report(run, previous_run(history, parameters))
+    history.parent.mkdir(parents=True, exist_ok=True)
+    with history.open("a", encoding="utf-8") as file:
+        file.write(json.dumps(run) + "\n")
+
+if __name__ == "__main__":
+    main()
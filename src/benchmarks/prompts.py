@@ -0,0 +1,23 @@
+from pathlib import Path
+import json
+
+from prompt.prompt import LLAMA3_SYSTEM, LLAMA3_USER, LLAMA3_ASSISTANT, LLAMA3_ASSISTANT_HEADER, get_mode_system_prompt
+
+DEFAULT_TRANSCRIPTS = "benchmarks/transcripts/sample.json"
+
+def load_transcripts(path: str):
+    with Path(path).open("r", encoding="utf-8") as file:
+        return json.load(file)
+
+def transcript_prompts(transcript):
+    """One prompt per AI turn, containing the conversation up to that turn."""
+    mode = transcript.get("mode")
+    system_prompt = get_mode_system_prompt(mode) + f"\nJob Description: {transcript['job_description']}"
+    prompt = LLAMA3_SYSTEM.format(system_prompt)
+    for turn in transcript["turns"]:
+        prompt += LLAMA3_USER.format(turn["user"])
+        yield prompt + LLAMA3_ASSISTANT_HEADER
+        prompt += LLAMA3_ASSISTANT.format(turn["ai"])
+
+def load_prompts(path: str = DEFAULT_TRANSCRIPTS):
+    return [prompt for transcript in load_transcripts(path) for prompt in transcript_prompts(transcript)]
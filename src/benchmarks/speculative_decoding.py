@@ -0,0 +1,81 @@
+"""
+Compare decode throughput with speculative decoding on and off.
+
+Replays every AI turn of the recorded transcripts against the model, once per speculative mode,
+with greedy sampling so all modes produce the same text. Run from the src folder:
+
+    python -m benchmarks.speculative_decoding --transcripts benchmarks/transcripts/sample.json
+"""
+from pathlib import Path
+import argparse
+import json
+import time
+
+import setup_llama
+from benchmarks.prompts import DEFAULT_TRANSCRIPTS, load_prompts
+from inference.speculative import SPECULATIVE_MODES
+
+def run_prompt(model, prompt: str, max_tokens: int):
+    """Generate greedily and time prompt evaluation (until the first token) and decoding separately."""
+    model.reset()
+    started = time.perf_counter()
+    first_token_at = None
+    text = ""
+    for chunk in model(prompt, max_tokens=max_tokens, temperature=0.0, top_k=1, stream=True):
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        text += chunk["choices"][0]["text"]
+    finished = time.perf_counter()
+    completion_tokens = len(model.tokenize(text.encode("utf-8"), add_bos=False))
+    return {
+        "text": text,
+        "completion_tokens": completion_tokens,
+        "ttft": (first_token_at or finished) - started,
+        "decode_seconds": finished - (first_token_at or finished),
+    }
+
+def benchmark_mode(mode: str, prompts, args):
+    model = setup_llama.setup_model(args.threads, args.batch_size, args.n_ctx, speculative=mode)
+    results = [run_prompt(model, prompt, args.max_tokens) for prompt in prompts]
+    model.close()
+    # The first token of every answer comes out of prompt evaluation, the rest is decoding
+    decoded = sum(max(0, result["completion_tokens"] - 1) for result in results)
+    decode_seconds = sum(result["decode_seconds"] for result in results)
+    return {
+        "mode": mode,
+        "prompts": len(results),
+        "completion_tokens": sum(result["completion_tokens"] for result in results),
+        "mean_ttft": sum(result["ttft"] for result in results) / max(1, len(results)),
+        "decode_tokens_per_second": decoded / decode_seconds if decode_seconds else 0.0,
+        "texts": [result["text"] for result in results],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcripts", default=DEFAULT_TRANSCRIPTS)
+    parser.add_argument("--modes", nargs="+", default=["none", "prompt_lookup"], choices=SPECULATIVE_MODES,
+                        help="'draft' also needs LLAMA_DRAFT_MODEL_PATH")
+    parser.add_argument("--threads", type=int, default=setup_llama.llama_settings.LLAMA_N_THREADS)
+    parser.add_argument("--batch-size", type=int, default=setup_llama.llama_settings.LLAMA_N_BATCH)
+    parser.add_argument("--n-ctx", type=int, default=setup_llama.llama_settings.LLAMA_N_CTX)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.transcripts)
+    results = [benchmark_mode(mode, prompts, args) for mode in args.modes]
+
+    baseline = results[0]
+    print(f"{'mode':<15}{'prompts':>8}{'tokens':>8}{'ttft s':>9}{'decode tok/s':>14}{'speedup':>9}{'same text':>11}")
+    for result in results:
+        speedup = result["decode_tokens_per_second"] / baseline["decode_tokens_per_second"] if baseline["decode_tokens_per_second"] else 0.0
+        same_text = result["texts"] == baseline["texts"]
+        print(f"{result['mode']:<15}{result['prompts']:>8}{result['completion_tokens']:>8}{result['mean_ttft']:>9.2f}"
+              f"{result['decode_tokens_per_second']:>14.2f}{speedup:>9.2f}{str(same_text):>11}")
+
+    if args.output:
+        with Path(args.output).open("w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
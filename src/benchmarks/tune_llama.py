@@ -0,0 +1,101 @@
+"""
+Find the fastest llama runtime settings for this machine.
+
+Sweeps thread and batch size combinations over a fixed prompt set and reports prompt evaluation
+and decode throughput for each. The best combination is printed as .env lines. Run from the src folder:
+
+    python -m benchmarks.tune_llama --threads 4 8 16 --batch-sizes 256 512 --ubatch-sizes 256 512
+"""
+from pathlib import Path
+import argparse
+import itertools
+import json
+import time
+
+import setup_llama
+from benchmarks.prompts import DEFAULT_TRANSCRIPTS, load_prompts
+
+def measure(model, prompt: str, decode_tokens: int):
+    """Time the evaluation of the prompt and the greedy decoding of decode_tokens tokens after it."""
+    tokens = model.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+    model.reset()
+    started = time.perf_counter()
+    model.eval(tokens)
+    evaluated = time.perf_counter()
+    # The prompt is already in the context, so the completion only re-evaluates its last token and then decodes
+    response = model(prompt, max_tokens=decode_tokens, temperature=0.0, top_k=1)
+    finished = time.perf_counter()
+    return {
+        "prompt_tokens": len(tokens),
+        "prompt_seconds": evaluated - started,
+        "completion_tokens": response["usage"]["completion_tokens"],
+        "decode_seconds": finished - evaluated,
+    }
+
+def benchmark_config(threads: int, threads_batch: int, batch_size: int, ubatch_size: int, prompts, args):
+    model = setup_llama.setup_model(threads, batch_size, args.n_ctx, speculative="none",
+                                    threads_batch=threads_batch, ubatch_size=ubatch_size)
+    # Untimed warm-up so the weights are paged in before measuring
+    measure(model, prompts[0], 1)
+    runs = [measure(model, prompt, args.decode_tokens) for prompt in prompts for _ in range(args.repeat)]
+    model.close()
+    prompt_seconds = sum(run["prompt_seconds"] for run in runs)
+    decode_seconds = sum(run["decode_seconds"] for run in runs)
+    return {
+        "threads": threads,
+        "threads_batch": threads_batch,
+        "batch_size": batch_size,
+        "ubatch_size": ubatch_size,
+        "prompt_tokens_per_second": sum(run["prompt_tokens"] for run in runs) / prompt_seconds,
+        "decode_tokens_per_second": sum(run["completion_tokens"] for run in runs) / decode_seconds,
+    }
+
+def main():
+    settings = setup_llama.llama_settings
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcripts", default=DEFAULT_TRANSCRIPTS, help="Prompt set, one prompt per recorded AI turn")
+    parser.add_argument("--max-prompts", type=int, default=3)
+    parser.add_argument("--threads", type=int, nargs="+", default=[settings.LLAMA_N_THREADS])
+    parser.add_argument("--threads-batch", type=int, nargs="+", help="Defaults to the value of --threads")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[settings.LLAMA_N_BATCH])
+    parser.add_argument("--ubatch-sizes", type=int, nargs="+", default=[settings.LLAMA_N_UBATCH])
+    parser.add_argument("--n-ctx", type=int, default=settings.LLAMA_N_CTX)
+    parser.add_argument("--decode-tokens", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--optimize", choices=["decode", "prompt"], default="decode",
+                        help="Which throughput picks the best configuration")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.transcripts)[:args.max_prompts]
+    results = []
+    for threads, batch_size, ubatch_size in itertools.product(args.threads, args.batch_sizes, args.ubatch_sizes):
+        if ubatch_size > batch_size:
+            continue
+        for threads_batch in args.threads_batch or [threads]:
+            result = benchmark_config(threads, threads_batch, batch_size, ubatch_size, prompts, args)
+            print(f"threads={threads} threads_batch={threads_batch} n_batch={batch_size} n_ubatch={ubatch_size}: "
+                  f"prompt {result['prompt_tokens_per_second']:.1f} tok/s, decode {result['decode_tokens_per_second']:.2f} tok/s",
+                  flush=True)
+            results.append(result)
+
+    key = f"{args.optimize}_tokens_per_second"
+    results.sort(key=lambda result: result[key], reverse=True)
+    print(f"\n{'threads':>8}{'t_batch':>8}{'n_batch':>8}{'n_ubatch':>9}{'prompt tok/s':>14}{'decode tok/s':>14}")
+    for result in results:
+        print(f"{result['threads']:>8}{result['threads_batch']:>8}{result['batch_size']:>8}{result['ubatch_size']:>9}"
+              f"{result['prompt_tokens_per_second']:>14.1f}{result['decode_tokens_per_second']:>14.2f}")
+
+    best = results[0]
+    print(f"\nBest configuration by {args.optimize} throughput, add to src/.env:")
+    print(f"LLAMA_N_THREADS={best['threads']}")
+    print(f"LLAMA_N_THREADS_BATCH={best['threads_batch']}")
+    print(f"LLAMA_N_BATCH={best['batch_size']}")
+    print(f"LLAMA_N_UBATCH={best['ubatch_size']}")
+
+    if args.output:
+        with Path(args.output).open("w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pydantic_settings import BaseSettings
+from pydantic import Field
+import asyncio
+import functools
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+class ChatSettings(BaseSettings):
+    CHAT_MAX_CONCURRENCY: int = Field(default=4, description="Chat turns whose blocking work (auth, inference, database) runs at the same time")
+    CHAT_MAX_PENDING: int = Field(default=16, description="Chat turns admitted at once, running or waiting. Further requests get a 503")
+    CHAT_DEADLINE_SECONDS: float = Field(default=120.0, description="Seconds a chat turn may take, waiting for the model included, before its generation is aborted. 0 disables the deadline")
+
+    class Config:
+        env_file = os.path.join(os.path.dirname(__file__), ".env")
+        env_file_encoding = "utf-8"
+        env_prefix = ""
+        extra = "ignore"  # This will ignore extra fields in the .env file
+
+chat_settings = ChatSettings()
+
+class AdmissionRejected(Exception):
+    """Raised when the admission limit for chat turns is reached."""
+
+    def __init__(self, retry_after: int, pending: int):
+        super().__init__(f"Chat admission limit reached ({pending} turns pending)")
+        self.retry_after = retry_after
+        self.pending = pending
+
+class ChatAdmission:
+    """
+    Admission control for chat turns.
+
+    The blocking parts of a turn run on a bounded thread pool so the event loop stays free for
+    other endpoints. At most max_pending turns are admitted; the rest are rejected right away
+    with an estimate of when to retry, instead of piling up behind the model.
+    """
+
+    def __init__(self, max_concurrency: int, max_pending: int):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="chat")
+        # Only touched from the event loop, so no lock is needed
+        self.pending = 0
+        self.average_duration = 5.0  # seconds, moving average of finished turns
+
+    def retry_after(self) -> int:
+        """Estimated seconds until a slot frees up."""
+        return max(1, math.ceil(self.average_duration * self.pending / self.max_concurrency))
+
+    def acquire(self) -> int:
+        """Admit a turn and return its queue position (0 means it runs right away)."""
+        if self.pending >= self.max_pending:
+            raise AdmissionRejected(self.retry_after(), self.pending)
+        position = max(0, self.pending - self.max_concurrency + 1)
+        self.pending += 1
+        return position
+
+    def release(self, started_at: float):
+        self.pending -= 1
+        duration = time.monotonic() - started_at
+        self.average_duration = 0.8 * self.average_duration + 0.2 * duration
+
+    @asynccontextmanager
+    async def admit(self):
+        position = self.acquire()
+        started_at = time.monotonic()
+        try:
+            yield position
+        finally:
+            self.release(started_at)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking call on the chat thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+chat_admission = ChatAdmission(chat_settings.CHAT_MAX_CONCURRENCY, chat_settings.CHAT_MAX_PENDING)
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+
+from inference.cancellation import CancelToken, GenerationCancelled
+from inference.metrics import CHAT_TURNS, CHAT_TURN_WAIT
+
+logger = logging.getLogger(__name__)
+
+class ChatTurn:
+    """
+    One chat turn, shared by every request that sent it while it was in flight.
+
+    The turn's generation streams its tokens to every attached stream, including the tokens
+    generated before a stream attached. It is cancelled once the last attached client has gone
+    away, or by its deadline.
+    """
+
+    def __init__(self, session_id: str, user_input: str, user: str, cancel: CancelToken, stream: bool):
+        self.session_id = session_id
+        self.user_input = user_input
+        self.user = user
+        self.cancel = cancel
+        self.stream = stream
+        self.task = None
+        self.tokens = []  # text streamed so far
+        self.queues = []  # token queues of the attached streams, None ends them
+        self.clients = 0
+
+    def attach(self):
+        """Register a client waiting for the turn. Returns the function it calls once it stops waiting."""
+        self.clients += 1
+        left = False
+
+        def leave():
+            nonlocal left
+            if left:
+                return
+            left = True
+            self.clients -= 1
+            if not self.clients and not self.task.done():
+                logger.info(f"Every client of the turn in session {self.session_id} is gone, cancelling it")
+                self.cancel.cancel("disconnected")
+        return leave
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of the turn's tokens, starting with those already streamed and ending with None."""
+        queue = asyncio.Queue()
+        for token in self.tokens:
+            queue.put_nowait(token)
+        if self.task.done():
+            queue.put_nowait(None)
+        else:
+            self.queues.append(queue)
+        return queue
+
+    def publish(self, token):
+        if token is not None:
+            self.tokens.append(token)
+        for queue in self.queues:
+            queue.put_nowait(token)
+
+class ChatTurns:
+    """
+    Per-session serialization of chat turns.
+
+    Turns of one session run one after the other in the order they arrived, so two requests never
+    change a session at the same time; turns of different sessions run in parallel. A request that
+    sends the same input for the same session and user as a turn that is still waiting or running,
+    such as a double submit or a retry, attaches to that turn instead of starting another one.
+
+    Everything here runs on the event loop, so no lock is needed. With several worker processes a
+    session's turns are only serialized within one worker; the versioned session backends reject
+    a concurrent turn from another worker with a conflict.
+    """
+
+    def __init__(self):
+        self._turns = {}  # (session id, user, input) -> turn waiting or running
+        self._sessions = {}  # session id -> [lock, turns waiting or running]
+
+    def join(self, session_id: str, user_input: str, user: str, run, stream: bool = False, timeout: float = None) -> ChatTurn:
+        """
+        Turn for user_input in the session: the same turn still in flight, or a new one that calls
+        run(on_token, cancel) once the previous turns of the session are done. stream asks a new
+        turn to stream its tokens. Attach to the returned turn and await turn.task through
+        asyncio.shield, so a request that stops waiting does not cancel it for the others.
+        """
+        key = (session_id, user, user_input)
+        turn = self._turns.get(key)
+        if turn is not None:
+            logger.info(f"Request for session {session_id} attaches to the same turn in flight")
+            CHAT_TURNS.labels("attached").inc()
+            return turn
+        CHAT_TURNS.labels("started").inc()
+        turn = ChatTurn(session_id, user_input, user, CancelToken(timeout), stream)
+        self._turns[key] = turn
+        entry = self._sessions.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        turn.task = asyncio.ensure_future(self._run(turn, entry[0], run))
+        turn.task.add_done_callback(lambda _: self._finish(key, turn))
+        # Nobody may wait for a turn whose clients are all gone, collect its error so it is not reported as unhandled
+        turn.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return turn
+
+    async def _run(self, turn: ChatTurn, lock: asyncio.Lock, run):
+        queued = time.perf_counter()
+        async with lock:
+            CHAT_TURN_WAIT.observe(time.perf_counter() - queued)
+            if not turn.clients:
+                # Gave up while waiting for the previous turn, leave the session alone
+                raise GenerationCancelled(turn.cancel.reason or "disconnected")
+            on_token = None
+            if turn.stream:
+                loop = asyncio.get_running_loop()
+
+                def on_token(token: str):
+                    loop.call_soon_threadsafe(turn.publish, token)
+            return await run(on_token, turn.cancel)
+
+    def _finish(self, key, turn: ChatTurn):
+        del self._turns[key]
+        entry = self._sessions[turn.session_id]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._sessions[turn.session_id]
+        turn.publish(None)
+
+chat_turns = ChatTurns()
@@ -0,0 +1,21 @@
+import argparse
+
+import pytest
+
+@pytest.fixture(scope="session", autouse=True)
+def offline_environment():
+    """Settings the app modules read at import, database/setup_maria_db.py among them."""
+    from benchmarks import pipeline
+    pipeline.install_offline_environment()
+
+@pytest.fixture(scope="session")
+def chat_app():
+    """
+    get_model_response with FakeLlama and the stub database of the pipeline benchmark, model loaded.
+    The app modules are imported here, after the stubs are installed, never at test module level.
+    """
+    from benchmarks import pipeline
+    pipeline.install_stubs(argparse.Namespace(prompt_token_delay=0.0, token_delay=0.0, reply_tokens=20, log_level="WARNING"))
+    import get_model_response
+    get_model_response.load_models()
+    return get_model_response
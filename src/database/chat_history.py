@@ -53,6 +53,43 @@ def get_chat_history(session_id: str):
             cursor.close()
             connection.close()
 
+def get_recent_conversation(session_id: str, max_messages: int):
+    """
+    Latest job description of a session and its most recent chat messages, oldest first, read in one query.
+    Returns (job_details or None, [(sender, message_text), ...]).
+    """
+    connection = None
+    try:
+        connection = setup_maria_db.get_db_connection(db_settings.DB_NAME)
+        cursor = connection.cursor()
+
+        query = """(SELECT 'job' AS sender, job_details AS message_text, job_id AS position
+            FROM JobDescriptions WHERE session_id = %s ORDER BY job_id DESC LIMIT 1)
+        UNION ALL
+        (SELECT sender, message_text, message_id AS position
+            FROM ChatHistory WHERE session_id = %s ORDER BY message_id DESC LIMIT %s)"""
+        cursor.execute(query, (session_id, session_id, max_messages))
+
+        job_details = None
+        messages = []
+        for (sender, message_text, position) in cursor:
+            if sender == "job":
+                job_details = message_text
+            else:
+                messages.append((position, sender, message_text))
+        messages.sort()
+        return job_details, [(sender, message_text) for _, sender, message_text in messages]
+
+    except mariadb.Error as e:
+        # Not the same as a session that was never stored, the caller must not start it over
+        logger.error(f"Error while retrieving recent conversation: {e}")
+        logger.error(f"Session ID: {session_id}")
+        raise
+    finally:
+        if connection:
+            cursor.close()
+            connection.close()
+
 def save_extracted_notes(session_id: str, note_text: str):
     connection = None
     try:
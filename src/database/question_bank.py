@@ -0,0 +1,53 @@
+import mariadb
+import logging
+from . import setup_maria_db
+from .setup_maria_db import db_settings
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def save_question_bank(job_key: str, questions: list):
+    """Replace the stored questions of a job description, ranked in list order."""
+    connection = None
+    try:
+        connection = setup_maria_db.get_db_connection(db_settings.DB_NAME)
+        cursor = connection.cursor()
+
+        cursor.execute("DELETE FROM InterviewQuestions WHERE job_key = %s", (job_key,))
+        query = """INSERT INTO InterviewQuestions (job_key, question_rank, question_text, created_at)
+        VALUES (%s, %s, %s, FROM_UNIXTIME(%s))"""
+        now = time.time()
+        cursor.executemany(query, [(job_key, rank, question, now) for rank, question in enumerate(questions)])
+
+        connection.commit()
+
+    except mariadb.Error as e:
+        logger.error(f"Error while trying to save the question bank: {e}")
+        logger.error(f"Job key: {job_key}")
+        return None
+    finally:
+        if connection:
+            cursor.close()
+            connection.close()
+
+def get_question_bank(job_key: str):
+    """Stored questions of a job description, best ranked first."""
+    connection = None
+    try:
+        connection = setup_maria_db.get_db_connection(db_settings.DB_NAME)
+        cursor = connection.cursor()
+
+        query = "SELECT question_text FROM InterviewQuestions WHERE job_key = %s ORDER BY question_rank ASC"
+        cursor.execute(query, (job_key,))
+
+        return [question for (question,) in cursor.fetchall()]
+
+    except mariadb.Error as e:
+        logger.error(f"Error while trying to retrieve the question bank: {e}")
+        logger.error(f"Job key: {job_key}")
+        return []
+    finally:
+        if connection:
+            cursor.close()
+            connection.close()
@@ -8,6 +8,14 @@ from pydantic import Field
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Chat sessions shared by the workers, see SqlSessionStore in session_store.py, which also creates it in SQLite
+SESSION_STATE_TABLE = """CREATE TABLE IF NOT EXISTS SessionState (
+    session_id VARCHAR(255) PRIMARY KEY,
+    version INT NOT NULL,
+    data MEDIUMTEXT NOT NULL,
+    updated_at DOUBLE NOT NULL
+)"""
+
 class DatabaseSettings(BaseSettings):
     DB_NAME: str = Field(..., description="Database name")
     DB_USER: str = Field(..., description="Database user")
@@ -82,6 +90,16 @@ def create_tables():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (session_id) REFERENCES Sessions(session_id) ON DELETE CASCADE
             )""",
+            # Interview questions generated per job description, keyed by the hash of its normalized text
+            """CREATE TABLE IF NOT EXISTS InterviewQuestions (
+                question_id INT AUTO_INCREMENT PRIMARY KEY,
+                job_key CHAR(64) NOT NULL,
+                question_rank INT NOT NULL,
+                question_text TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX (job_key)
+            )""",
+            SESSION_STATE_TABLE,
             """CREATE TABLE IF NOT EXISTS UserPreferences (
                 preference_id INT AUTO_INCREMENT PRIMARY KEY,
                 user_id VARCHAR(36) NOT NULL UNIQUE,
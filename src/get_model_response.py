@@ -1,9 +1,31 @@
 from database import job_description
 from scraper import scrape_for_job_description
 import setup_llama
+import llama_cpp
 from fastapi import HTTPException
-from collections import defaultdict
-from prompt.prompt import get_system_prompt
+from functools import lru_cache
+import threading
+import hashlib
+import copy
+import time
+from prompt.prompt import (
+    MODES, LLAMA3_SYSTEM, LLAMA3_USER, LLAMA3_ASSISTANT, LLAMA3_ASSISTANT_HEADER, LLAMA3_INSTRUCTION,
+    detect_mode, get_mode_system_prompt
+)
+from inference.state_cache import SessionStateCache, compact_state
+from inference.engine import InferenceEngine, EngineOverloadedError
+from inference.batching import BatchedEngine
+from inference.cancellation import GenerationCancelled, wait_for
+from inference.response_cache import ResponseCache
+from inference.memory import memory_report
+from inference.metrics import observe_generation, RESPONSE_CACHE, GENERATION_ERRORS
+from prompt.output_filter import ResponseFilter
+from prompt.history import Turn, PromptBuffer, USER, ASSISTANT, JOB_DESCRIPTION
+from prompt.profiles import GenerationProfile, get_profile, parse_interview_summary, format_interview_summary, NO_SUMMARY
+from session_store import (
+    SessionStore, SqliteSessionStore, MariaDBSessionStore, SessionLoadError, VersionConflict, TRANSIENT_KEYS
+)
+from question_bank import QuestionBankStore, job_description_key, build_question_bank_prompt, parse_question_bank, rank_questions
 import logging
 import re
 
@@ -11,48 +33,163 @@ import re
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-LLAMA3_SYSTEM = "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n{}\n<|eot_id|>"
-LLAMA3_USER = "<|start_header_id|>user<|end_header_id|>\n{}\n<|eot_id|>"
-LLAMA3_ASSISTANT = "<|start_header_id|>assistant<|end_header_id|>\n{}\n<|eot_id|>"
-
 JOB_KEYWORDS = [
     "responsibilities", "qualifications", "we are looking for",
     "skills required", "your tasks", "requirements", "job description"
 ]
 
-USER_RESPONSE_PATTERNS = [
-    r"User:.*?(?=\n|$)", r"Candidate:.*?(?=\n|$)", r"I would.*?(?=\n|$)",
-    r"Let me.*?(?=\n|$)", r"First,.*?(?=\n|$)", r"To answer.*?(?=\n|$)",
-    r"Regarding.*?(?=\n|$)", r"As a.*?(?=\n|$)",
-]
+JOB_DESCRIPTION_ACK = "Thank you for providing the job description. What would you like to do next?"
+QUIT_MESSAGE = (
+    "You have exited all modes. Available commands:\n"
+    "/interview - Start interview simulation\n"
+    "/quiz - Start quiz mode\n"
+    "/training - Start training mode\n"
+    "/selfcheck - Self check mode\n"
+    "/help - List all commands\n\n"
+    "Please enter a command to begin."
+)
+INTERVIEW_CONCLUDED = "The interview has concluded. If you want to start over, type /interview again."
+
+# Response length limits in tokens, the prompt history is windowed so at least MIN_RESPONSE_TOKENS fit
+MIN_RESPONSE_TOKENS = 200
+MAX_RESPONSE_TOKENS = 600
+
+settings = setup_llama.llama_settings
+# Pool of model workers, each with its own context, fed from a bounded request queue.
+# Created by load_models in the background, so importing this module does not load the model.
+engine = None
+# Vocabulary-only model for counting tokens outside the workers
+tokenizer = None
+# Set once every worker is loaded and has finished a warm-up generation
+model_ready = threading.Event()
+model_load_error = None
+# Guards history rewrites by the background summarization against prompt assembly
+history_lock = threading.RLock()
+# Saved llama state per session, so a turn only evaluates the tokens appended since the last one
+session_states = SessionStateCache(settings.LLAMA_STATE_CACHE_BYTES)
+# Responses for repeated, identical generations such as the first question of an interview
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL_SECONDS)
+CACHED_MODES = {mode.strip() for mode in settings.RESPONSE_CACHE_MODES.split(",") if mode.strip()}
+# Evaluated system prompt for every mode, new sessions start from these instead of an empty context.
+# States are portable between contexts of the same model, so all workers share them.
+prefix_states = {}
+# Ranked interview questions per job description, generated in the background once a job description is stored
+question_banks = QuestionBankStore(settings.QUESTION_BANK_CACHE_SIZE)
+
+def new_session():
+    return {
+        "history": [],  # Turn records
+        "job_description": None,
+        "mode": None,  # None, 'interview', 'quiz', 'training'
+        "is_interview_mode": False,
+        "interview_state": None,  # None, 'in_progress', 'finished'
+        "questions_asked": 0,
+        "max_questions": 3,  # adjust this
+        "summary_points": [],
+        "bank_questions_asked": [],  # questions of the question bank asked in the current interview
+        "running_summary": None,  # model-written summary of turns dropped from the history
+        "compacting": None,  # time.time() a history summary was submitted at, until it is applied
+        "turn_count": 0  # committed turns, background updates do not count
+    }
+
+def load_session(session_id: str):
+    """
+    Session that is not in memory, rebuilt from its job description and its most recent
+    SESSION_LOAD_TURNS turns stored in the database. None if nothing is stored for it.
+    """
+    from database.chat_history import get_recent_conversation
+    job_description, messages = get_recent_conversation(session_id, 2 * settings.SESSION_LOAD_TURNS)
+    if job_description is None and not messages:
+        return None
+    return replay_session(job_description, messages)
+
+def stored_turns(messages):
+    """
+    (user input, answer) pairs of stored (sender, message) rows. A row without its counterpart, such
+    as the answer of a turn whose user message is before the loaded window, or a user message whose
+    answer was never saved, is skipped without shifting the turns after it.
+    """
+    user_input = None
+    for sender, message in messages:
+        if sender == "user":
+            user_input = message
+        elif user_input is not None:
+            yield user_input, message
+            user_input = None
+
+def replay_session(job_description, messages):
+    """
+    Session state after the stored (sender, message) turns: the history as prompt_model_static
+    builds it, the selected mode, the progress of an interview and the number of turns. The turns
+    may be only the most recent ones; an interview that ended before them is recognized by its
+    closing answers.
+    """
+    session = new_session()
+    session["job_description"] = job_description
+    history = session["history"]
+    for user_input, ai_response in stored_turns(messages):
+        session["turn_count"] += 1
+        if ai_response == JOB_DESCRIPTION_ACK:
+            history.append(Turn(JOB_DESCRIPTION, job_description or user_input))
+            continue
+        mode = detect_mode(user_input)
+        if mode is not None:
+            session["mode"] = mode
+        if user_input.strip().lower() == "/q":
+            session.update(is_interview_mode=False, interview_state=None, mode=None, questions_asked=0, summary_points=[])
+        elif "/interview" in user_input.lower():
+            session.update(is_interview_mode=True, interview_state="in_progress", questions_asked=1, summary_points=[])
+        elif ai_response == INTERVIEW_CONCLUDED:
+            # Answered without touching the history
+            session.update(is_interview_mode=True, interview_state="finished")
+            continue
+        elif session["is_interview_mode"]:
+            session["questions_asked"] += 1
+            if session["questions_asked"] >= session["max_questions"]:
+                session["interview_state"] = "finished"
+                _, _, summary = ai_response.partition("\n\nHere is your interview summary:\n")
+                session["summary_points"].append(summary or NO_SUMMARY)
+        history.append(Turn(USER, user_input))
+        history.append(Turn(ASSISTANT, ai_response))
+    return session
 
-model = setup_llama.setup_model(2, 512, 2048)
+def create_session_store():
+    """
+    Session store selected by SESSION_BACKEND: 'memory' keeps the sessions in this process, 'sqlite'
+    shares them between the workers of one machine and 'mariadb' between all nodes. Sessions that
+    are not in the store are loaded from the chat history in the database.
+    """
+    backend = settings.SESSION_BACKEND
+    if backend == "memory":
+        return SessionStore(
+            new_session, settings.SESSION_MAX_COUNT, settings.SESSION_MAX_BYTES, settings.SESSION_IDLE_TTL_SECONDS,
+            load=load_session, on_evict=session_states.pop
+        )
+    if backend == "sqlite":
+        return SqliteSessionStore(settings.SESSION_SQLITE_PATH, new_session, settings.SESSION_IDLE_TTL_SECONDS, load=load_session)
+    if backend == "mariadb":
+        return MariaDBSessionStore(new_session, settings.SESSION_IDLE_TTL_SECONDS, load=load_session)
+    raise ValueError(f"Unknown session backend {backend}")
 
-#store chat session using a simple in memory dictionary
-chat_sessions = defaultdict(lambda: {
-    "history": [],
-    "job_description": None,
-    "is_interview_mode": False,
-    "interview_state": None,  # None, 'in_progress', 'finished'
-    "questions_asked": 0,
-    "max_questions": 5,  # adjust this
-    "summary_points": []
-})
+chat_sessions = create_session_store()
+# Session fields a turn changes besides the history
+TURN_STATE_KEYS = ("mode", "is_interview_mode", "interview_state", "questions_asked", "summary_points", "bank_questions_asked")
+# Session fields only the background history summary changes, besides dropping the start of the history
+SUMMARY_KEYS = ("running_summary", "compacting")
+# A summary still marked as running after this long was lost, e.g. with the worker that submitted it
+COMPACTION_TIMEOUT_SECONDS = 600
 
 def get_chat_history(session_id: str):
     """Retrieve chat session or create a new one."""
     try:
-        if session_id not in chat_sessions:
-            chat_sessions[session_id] = {
-                "history": [],
-                "job_description": None,
-                "is_interview_mode": False,
-                "interview_state": None,
-                "questions_asked": 0,
-                "max_questions": 3,
-                "summary_points": []
-            }
-        return chat_sessions[session_id]
+        return chat_sessions.get(session_id)
+    except SessionLoadError:
+        # Starting over would ask for the job description again, the client retries instead
+        raise HTTPException(
+            status_code=503,
+            detail="The conversation could not be loaded, please try again shortly.",
+            headers={"Retry-After": "5"}
+        )
     except Exception as e:
         logger.error(f"Error retrieving chat history for session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to retrieve chat history")
@@ -66,21 +203,15 @@ def is_url(text: str):
     """Basic check if text is a URL."""
     return re.match(r'^https?://', text) is not None
 
-def validate_interview_response(response: str) -> str:
-    # Remove any text that appears to be a user response
-    for pattern in USER_RESPONSE_PATTERNS:
-        response = re.sub(pattern, "", response, flags=re.IGNORECASE)
-    response = "\n".join(line for line in response.split("\n") if line.strip())
-    return response.strip()
-
-def store_job_description(session_id: str, user_input: str):
+def store_job_description(session_id: str, user_input: str, session=None):
+    """Store the job description in the session of the current turn, or in the stored session if none is given."""
     try:
-        session = get_chat_history(session_id)
+        session = session if session is not None else get_chat_history(session_id)
         if not isinstance(session, dict):
             logger.error(f"Session for {session_id} is not a dict: {type(session)}")
             raise HTTPException(status_code=500, detail="Session data corrupted.")
         session["job_description"] = user_input
-        session["history"].append(f"User provided Job Description: {user_input}")
+        session["history"].append(Turn(JOB_DESCRIPTION, user_input))
         logger.info(f"Job Description Stored for Session {session_id}")
         # Also save to the database
         from database.job_description import create_job_description
@@ -88,6 +219,7 @@ def store_job_description(session_id: str, user_input: str):
     except Exception as e:
         logger.error(f"Error storing job description for session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to store job description")
+    schedule_question_bank(session_id, user_input)
     if job_description is None:
         # Check if input is URL
         if is_url(user_input):
@@ -102,52 +234,566 @@ def store_job_description(session_id: str, user_input: str):
         # Check if input looks like a job description
         elif looks_like_job_description(user_input):
             store_job_description(session_id, user_input)
-            return {"response": "Thank you for providing the job description. What would you like to do next?"}
+            return {"response": JOB_DESCRIPTION_ACK}
         
         # Fallback: treat it as job description anyway
         else:
             store_job_description(session_id, user_input)
             return {"response": "Thanks! We’ve saved this as your job description. Let me know what you’d like to do next."}
 
-def build_llama3_prompt(session, user_input, ai_response=None):
-    system_prompt = get_system_prompt(user_input)
+def build_system_prompt(mode, job_description, running_summary=None):
+    # The system prompt only depends on the session mode, so it stays a stable prefix across turns
+    system_prompt = get_mode_system_prompt(mode)
     system_prompt = re.sub(r"^(<\|begin_of_text\|>)+", "", system_prompt).lstrip()
-    job_description = session["job_description"]
-    prompt = LLAMA3_SYSTEM.format(system_prompt + f"\nJob Description: {job_description}")
-    for entry in session["history"]:
-        if entry.startswith("User: "):
-            prompt += LLAMA3_USER.format(entry[6:])
-        elif entry.startswith("AI: "):
-            prompt += LLAMA3_ASSISTANT.format(entry[4:])
-    prompt += LLAMA3_USER.format(user_input)
-    if ai_response:
-        prompt += LLAMA3_ASSISTANT.format(ai_response)
+    system_prompt += f"\nJob Description: {job_description}"
+    if running_summary:
+        system_prompt += f"\nSummary of the earlier conversation: {running_summary}"
+    return LLAMA3_SYSTEM.format(system_prompt)
+
+def build_system_prefix(mode):
+    """The part of the system prompt every session of a mode shares, up to the job description."""
+    prompt = build_system_prompt(mode, "")
+    # Stop before the space so the boundary tokenizes the same way as in a full prompt
+    return prompt[:prompt.index("\nJob Description:") + len("\nJob Description:")]
+
+def count_tokens(text: str, add_bos: bool = False) -> int:
+    """Number of tokens the model sees for the text, tokenized the same way as a completion prompt."""
+    return len(tokenizer.tokenize(text.encode("utf-8"), add_bos=add_bos, special=True))
+
+@lru_cache(maxsize=128)
+def count_system_tokens(system_prompt: str) -> int:
+    # The completion adds a BOS token in front of the prompt
+    return count_tokens(system_prompt, add_bos=True)
+
+def turn_tokens(turn: Turn) -> int:
+    """Token count of a turn's prompt block, counted once and cached in the turn."""
+    if turn.tokens is None:
+        block = turn.block()
+        turn.tokens = count_tokens(block) if block else 0
+    return turn.tokens
+
+def is_current_turn(history, user_input: str) -> bool:
+    """Whether the last history turn is the user input of the turn being answered."""
+    return bool(history) and history[-1].role == USER and history[-1].text == user_input
+
+def assemble_prompt(session, user_input, ai_response=None, max_prompt_tokens=None, instruction=None, reserve_tokens=0):
+    """
+    Build the prompt and count its tokens. With max_prompt_tokens the oldest history turns are
+    dropped until the prompt fits, and as far as the history goes until reserve_tokens more are
+    free; the system prompt, job description and current turn are always kept. The history part
+    comes from the session's prompt buffer, which only formats the new turns. An instruction is
+    placed after the current turn and applies to the answer to it only.
+    """
+    with history_lock:
+        system_prompt = build_system_prompt(session.get("mode"), session["job_description"], session.get("running_summary"))
+        history = session["history"]
+        # Callers append the current user turn to the history before building the prompt
+        current = is_current_turn(history, user_input)
+        tail = "" if current else LLAMA3_USER.format(user_input)
+        if instruction and not ai_response:
+            tail += LLAMA3_INSTRUCTION.format(instruction)
+        tail += LLAMA3_ASSISTANT.format(ai_response) if ai_response else LLAMA3_ASSISTANT_HEADER
+        fixed_tokens = count_system_tokens(system_prompt) + count_tokens(tail)
+        limit = None
+        if max_prompt_tokens is not None:
+            current_tokens = turn_tokens(history[-1]) if current else 0
+            if fixed_tokens + current_tokens > max_prompt_tokens:
+                raise HTTPException(status_code=413, detail="The job description and message are too long for the model's context.")
+            limit = max(max_prompt_tokens - fixed_tokens - reserve_tokens, current_tokens)
+        buffer = session.get("prompt_buffer")
+        if buffer is None:
+            buffer = session["prompt_buffer"] = PromptBuffer()
+        kept_from = buffer.update(history, turn_tokens, limit)
+        prompt = system_prompt + buffer.text + tail
+        n_tokens = fixed_tokens + buffer.tokens
+    if kept_from > 0:
+        logger.info(f"History windowed: dropped {kept_from} of {len(history)} entries to fit {max_prompt_tokens} prompt tokens")
+    return prompt, n_tokens
+
+def build_llama3_prompt(session, user_input, ai_response=None, max_prompt_tokens=None):
+    prompt, _ = assemble_prompt(session, user_input, ai_response, max_prompt_tokens)
     return prompt
 
-def extract_summary_points(text):
-    # Try to extract code block first
-    code_block = re.search(r"```[\s\S]*?```", text)
-    if code_block:
-        return code_block.group(0)
-    # Try to extract summary after the summary phrase
-    summary_match = re.search(
-        r"This concludes our interview\. Here's a summary of your performance:(.*)", text, re.DOTALL)
-    if summary_match:
-        summary_text = summary_match.group(1).strip()
-        # If not already in a code block, wrap it
-        if not summary_text.startswith("```"):
-            summary_text = "```\n" + summary_text + "\n```"
-        return summary_text
-    # fallback: try to extract lines starting with -
-    lines = [line for line in text.splitlines() if line.strip().startswith("-")]
-    if lines:
-        return "```\n" + "\n".join(lines) + "\n```"
-    return "```No summary generated.\n```"
-
-def prompt_model_static(session_id: str, user_input: str):
+def prepare_prompt(session, user_input, profile=None, max_response_tokens=MAX_RESPONSE_TOKENS):
+    """
+    Prompt for the next turn, fitted into the context, and the number of tokens left for the response.
+    Structured output is useless when cut off, so for a structured profile older history turns make
+    room for max_response_tokens as far as they go.
+    """
+    n_ctx = settings.LLAMA_N_CTX
+    instruction = profile.instruction if profile is not None else None
+    reserve_tokens = max_response_tokens - MIN_RESPONSE_TOKENS if profile is not None and profile.structured else 0
+    prompt, prompt_tokens = assemble_prompt(session, user_input, max_prompt_tokens=n_ctx - MIN_RESPONSE_TOKENS,
+                                            instruction=instruction, reserve_tokens=reserve_tokens)
+    token_budget = min(max_response_tokens, n_ctx - prompt_tokens)
+    return prompt, token_budget
+
+def compute_prefix_states(model):
+    for mode in (None, *MODES):
+        tokens = model.tokenize(build_system_prefix(mode).encode("utf-8"), add_bos=True, special=True)
+        model.reset()
+        model.eval(tokens)
+        prefix_states[mode] = compact_state(model.save_state())
+        logger.info(f"Precomputed prefix state for mode {mode}: {len(tokens)} tokens")
+
+def warm_prefix_states():
+    """Evaluate the shared system prefix of every mode once and keep a snapshot of each."""
+    engine.submit(compute_prefix_states, priority="background").result()
+
+WARM_UP_PROMPT = LLAMA3_SYSTEM.format("You are a helpful assistant.") + LLAMA3_USER.format("Hello") + LLAMA3_ASSISTANT_HEADER
+
+def warm_up_model(model):
+    model(WARM_UP_PROMPT, max_tokens=1)
+    model.reset()
+
+def load_models():
+    """Load the tokenizer and model workers, warm them up and precompute the shared prefixes."""
+    global engine, tokenizer, model_load_error
+    try:
+        started = time.monotonic()
+        logger.info("Loading model...")
+        tokenizer = setup_llama.setup_tokenizer()
+        if settings.LLAMA_BATCHED_SEQUENCES:
+            model, context = setup_llama.setup_batched_model()
+            engine = BatchedEngine(model, context, queue_size=settings.LLAMA_QUEUE_SIZE)
+            # Idle sequences keep their cache and are matched by prefix, so no prefix states are needed
+            engine.submit_generation(WARM_UP_PROMPT, 1).result()
+        else:
+            engine = InferenceEngine(
+                setup_llama.setup_model,
+                worker_count=settings.LLAMA_WORKERS,
+                queue_size=settings.LLAMA_QUEUE_SIZE,
+                warm_up=warm_up_model
+            )
+            # Precompute the shared prefixes so the first turn of a session skips the system prompt
+            warm_prefix_states()
+        model_ready.set()
+        logger.info(f"Model ready after {time.monotonic() - started:.1f}s")
+        log_memory()
+    except Exception as e:
+        model_load_error = str(e)
+        logger.error(f"Failed to load the model: {str(e)}", exc_info=True)
+
+def model_memory() -> dict:
+    """Memory of this worker process, with the share of the memory-mapped model weights."""
+    return memory_report(settings.LLAMA_MODEL_PATH)
+
+def log_memory():
+    report = model_memory()
+    if not report["process"]:
+        return
+    mib = 1024 * 1024
+    process, model = report["process"], report["model"]
+    logger.info(f"Worker {report['pid']} memory: RSS {process['rss'] / mib:.0f} MiB, shared {process['shared'] / mib:.0f} MiB, "
+                f"private {process['private'] / mib:.0f} MiB, model weights resident {model['rss'] / mib:.0f} MiB "
+                f"of which {model['shared'] / mib:.0f} MiB shared")
+
+def model_status() -> str:
+    if model_ready.is_set():
+        return "ready"
+    return "failed" if model_load_error else "loading"
+
+def restore_best_state(model, session_id: str, prompt: str):
+    """Load the saved state that shares the longest token prefix with the prompt, if it beats the current one."""
+    tokens = model.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+    best_state = None
+    best_prefix = model.longest_token_prefix(model.input_ids[:model.n_tokens], tokens)
+    for state in (session_states.get(session_id), *prefix_states.values()):
+        if state is None:
+            continue
+        prefix = model.longest_token_prefix(state.input_ids[:state.n_tokens], tokens)
+        if prefix > best_prefix:
+            best_state, best_prefix = state, prefix
+    if best_state is not None:
+        model.load_state(best_state)
+    logger.debug(f"Session {session_id}: reusing {best_prefix} of {len(tokens)} prompt tokens")
+    # llama_cpp evaluates at least the last prompt token again
+    return min(best_prefix, len(tokens) - 1)
+
+def run_on_model(model, session_id: str, prompt: str, max_tokens: int, on_token=None, profile=None, cancel=None):
+    if cancel is not None:
+        cancel.check()
+    started = time.perf_counter()
+    reused = restore_best_state(model, session_id, prompt)
+    response = generate(model, prompt, max_tokens, on_token, profile, cancel)
+    session_states.put(session_id, model.save_state())
+    response["usage"]["prompt_tokens_reused"] = reused
+    response["timings"]["started"] = started
+    return response
+
+def build_summary_prompt(running_summary, entries):
+    turns = "\n".join(str(turn) for turn in entries if turn.block())
+    return (
+        LLAMA3_SYSTEM.format(
+            "You summarize interview coaching conversations. Keep every question that was asked, "
+            "the key points of the candidate's answers and the feedback that was given. "
+            "Reply with the summary only."
+        )
+        + LLAMA3_USER.format(f"Summary so far:\n{running_summary or 'None'}\n\nNew conversation turns:\n{turns}")
+        + LLAMA3_ASSISTANT_HEADER
+    )
+
+def select_summary_entries(running_summary, candidates):
+    """
+    The oldest of the candidate entries whose summary prompt fits into the context next to
+    HISTORY_SUMMARY_MAX_TOKENS for the summary, and the entries to put into the prompt. An oldest
+    entry that alone is too long, such as a long pasted message, is put in cut to what fits.
+    """
+    budget = (settings.LLAMA_N_CTX - settings.HISTORY_SUMMARY_MAX_TOKENS
+              - count_tokens(build_summary_prompt(running_summary, []), add_bos=True))
+    count, used = 0, 0
+    for turn in candidates:
+        # The block of a turn is a little longer than its line in the summary prompt
+        used += turn_tokens(turn)
+        if used > budget:
+            break
+        count += 1
+    if count or not candidates or budget <= 0:
+        return candidates[:count], candidates[:count]
+    oldest = candidates[0]
+    text_budget = budget - (turn_tokens(oldest) - count_tokens(oldest.text))
+    if text_budget <= 0:
+        return [], []
+    text = tokenizer.detokenize(tokenizer.tokenize(oldest.text.encode("utf-8"), add_bos=False)[:text_budget])
+    return candidates[:1], [Turn(oldest.role, text.decode("utf-8", errors="ignore"))]
+
+def summarize_on_model(model, prompt: str, max_tokens: int, profile=None):
+    return generate(model, prompt, max_tokens, profile=profile)
+
+def schedule_compaction(session_id: str, session):
+    """
+    Once the history grows past HISTORY_SUMMARY_TRIGGER_TOKENS, fold the older entries into the
+    running summary. The summary is generated on the engine in the background, so the current
+    request does not wait for it and the next turns get a prompt of bounded size.
+    """
+    compacting = session.get("compacting")
+    if compacting and time.time() - compacting < COMPACTION_TIMEOUT_SECONDS:
+        return
+    with history_lock:
+        if sum(turn_tokens(turn) for turn in session["history"]) < settings.HISTORY_SUMMARY_TRIGGER_TOKENS:
+            return
+        candidates = session["history"][:len(session["history"]) - settings.HISTORY_KEEP_ENTRIES]
+        entries, prompt_entries = select_summary_entries(session.get("running_summary"), candidates)
+    if not entries:
+        return
+    if len(entries) < len(candidates):
+        logger.info(f"Summarizing {len(entries)} of {len(candidates)} history entries of session {session_id} to fit the context")
+    prompt = build_summary_prompt(session.get("running_summary"), prompt_entries)
+    profile = get_profile("history_summary")
+    try:
+        # Marked in the stored session, so the next turns, on any worker, do not submit the summary again
+        chat_sessions.update(session_id, lambda latest: latest.__setitem__("compacting", time.time()))
+    except Exception as e:
+        logger.error(f"Error marking the history summary of session {session_id}: {str(e)}")
+        return
+    submitted = time.perf_counter()
+    try:
+        future = submit_generation(session_id, prompt, settings.HISTORY_SUMMARY_MAX_TOKENS, profile=profile, session_state=False)
+    except EngineOverloadedError:
+        GENERATION_ERRORS.labels(profile.mode, "overloaded").inc()
+        logger.info(f"Inference queue is full, postponing history summary for session {session_id}")
+        chat_sessions.update(session_id, lambda latest: latest.__setitem__("compacting", None))
+        return
+    # Done callbacks run on the engine's thread, committing the session may write to the database
+    future.add_done_callback(lambda f: threading.Thread(
+        target=apply_compaction, args=(session_id, entries, f, profile.mode, submitted),
+        name="compaction", daemon=True).start())
+
+def apply_compaction(session_id: str, entries, future, mode: str, submitted: float):
+    """
+    Replace the summarized entries by the summary in the latest state of the session. Turns
+    committed meanwhile only appended to the history; if its start changed, the summary is dropped.
+    """
+    summary = None
+    try:
+        response = future.result()
+        observe_generation(mode, submitted, response)
+        summary = response["choices"][0]["text"].strip()
+    except Exception as e:
+        GENERATION_ERRORS.labels(mode, "failed").inc()
+        logger.error(f"Error summarizing history for session {session_id}: {str(e)}")
+    applied = False
+
+    def apply_summary(latest):
+        nonlocal applied
+        latest["compacting"] = None
+        with history_lock:
+            history = latest["history"]
+            applied = bool(summary) and history[:len(entries)] == entries
+            if applied:
+                del history[:len(entries)]
+                latest["running_summary"] = summary
+    try:
+        chat_sessions.update(session_id, apply_summary)
+    except Exception as e:
+        logger.error(f"Error storing the history summary of session {session_id}: {str(e)}")
+        return
+    if applied:
+        logger.info(f"Summarized {len(entries)} history entries for session {session_id}")
+    elif summary:
+        logger.info(f"History of session {session_id} changed while summarizing, discarding the summary")
+
+def schedule_question_bank(session_id: str, job_description: str):
+    """
+    Generate the question bank of a job description on the engine in the background, once per job
+    description. Interview mode opens with the best question of the bank instead of waiting for
+    the model, and falls back to its next questions when the model has nothing to ask.
+    """
+    if settings.QUESTION_BANK_SIZE <= 0 or not job_description or not model_ready.is_set():
+        return
+    key = job_description_key(job_description)
+    if not question_banks.claim(key):
+        return
+    prompt = build_question_bank_prompt(job_description, settings.QUESTION_BANK_SIZE)
+    profile = get_profile("question_bank")
+    submitted = time.perf_counter()
+    try:
+        future = submit_generation(session_id, prompt, settings.QUESTION_BANK_MAX_TOKENS, profile=profile, session_state=False)
+    except EngineOverloadedError:
+        question_banks.release(key)
+        GENERATION_ERRORS.labels(profile.mode, "overloaded").inc()
+        logger.info(f"Inference queue is full, skipping the question bank for session {session_id}")
+        return
+    # Done callbacks run on the engine's thread, saving the bank to the database must not hold up generation
+    future.add_done_callback(lambda f: threading.Thread(
+        target=apply_question_bank, args=(session_id, key, job_description, f, profile.mode, submitted),
+        name="question-bank", daemon=True).start())
+
+def apply_question_bank(session_id: str, key: str, job_description: str, future, mode: str, submitted: float):
+    try:
+        response = future.result()
+    except Exception as e:
+        question_banks.release(key)
+        GENERATION_ERRORS.labels(mode, "failed").inc()
+        logger.error(f"Error generating the question bank for session {session_id}: {str(e)}")
+        return
+    observe_generation(mode, submitted, response)
+    candidates = parse_question_bank(response["choices"][0]["text"])
+    questions = rank_questions(candidates or [], job_description, settings.QUESTION_BANK_SIZE)
+    if not questions:
+        question_banks.release(key)
+        GENERATION_ERRORS.labels(mode, "invalid_output").inc()
+        logger.warning(f"Question bank for session {session_id} has no usable questions: {response['choices'][0]['text']}")
+        return
+    try:
+        question_banks.put(key, questions)
+    except Exception as e:
+        question_banks.release(key)
+        logger.error(f"Error saving the question bank for session {session_id}: {str(e)}")
+        return
+    logger.info(f"Question bank of {len(questions)} questions ready for session {session_id}")
+
+def next_bank_question(session):
+    """Best question of the session's question bank not asked in this interview yet, None without a bank."""
+    if not session.get("job_description"):
+        return None
+    questions = question_banks.get(job_description_key(session["job_description"]))
+    asked = session.setdefault("bank_questions_asked", [])
+    for question in questions or []:
+        if question not in asked:
+            asked.append(question)
+            return question
+    return None
+
+def submit_model(session_id: str, prompt: str, max_tokens: int, on_token=None, profile=None, cancel=None, user=None):
+    """Queue a completion on the inference engine for the authenticated user and return its future."""
+    if not model_ready.is_set():
+        raise HTTPException(status_code=503, detail="The model is still loading, please try again shortly.", headers={"Retry-After": "10"})
+    return submit_generation(session_id, prompt, max_tokens, on_token, profile, cancel=cancel, user=user)
+
+def submit_generation(session_id: str, prompt: str, max_tokens: int, on_token=None, profile=None, session_state=True,
+                      cancel=None, user=None):
+    """
+    Queue a completion on whichever engine is running. On the worker pool session_state saves the
+    session's llama state afterwards; the batched engine keeps caches per sequence instead. The
+    generation is aborted once the CancelToken cancel fires. The engine schedules it by the
+    profile's priority class and the fair share of user.
+    """
+    profile = profile or get_profile(None)
+    schedule = {"priority": profile.priority, "user": user}
+    if isinstance(engine, BatchedEngine):
+        return engine.submit_generation(prompt, max_tokens, on_token, stop=profile.stop, grammar=profile.grammar, cancel=cancel,
+                                        **schedule)
+    if not session_state:
+        return engine.submit(summarize_on_model, prompt, max_tokens, profile, cost=max_tokens, **schedule)
+    return engine.submit(run_on_model, session_id, prompt, max_tokens, on_token, profile, cancel, cost=max_tokens, **schedule)
+
+def response_cache_key(session, max_tokens: int, profile: GenerationProfile):
+    """
+    Cache key for the next generation of a session, or None if the session's mode opts out of caching
+    because its answers are meant to vary. Built from the normalized inputs: mode, job description,
+    conversation so far and generation parameters.
+    """
+    mode = session.get("mode")
+    if (mode or "chat") not in CACHED_MODES:
+        return None
+    job_description_hash = hashlib.sha256((session.get("job_description") or "").encode("utf-8")).hexdigest()
+    conversation_hash = hashlib.sha256()
+    with history_lock:
+        parts = [session.get("running_summary") or "", *map(str, session["history"])]
+    for part in parts:
+        conversation_hash.update(" ".join(part.split()).encode("utf-8"))
+        conversation_hash.update(b"\0")
+    return (mode, job_description_hash, conversation_hash.hexdigest(), max_tokens, profile.name)
+
+def filter_tokens(output_filter: ResponseFilter, on_token=None):
+    """Token callback that streams the filtered text and asks the engine to stop once the filter has stopped."""
+    def on_filtered_token(token: str):
+        text = output_filter.feed(token)
+        if text and on_token is not None:
+            on_token(text)
+        return output_filter.stopped
+    return on_filtered_token
+
+def run_model(session_id: str, prompt: str, max_tokens: int, on_token=None, cache_key=None, output_filter=None, profile=None,
+              cancel=None, user=None):
+    """
+    Run a completion. When on_token is given the tokens are streamed to it as they are generated.
+    With an output_filter the text is cleaned while it is generated, and the generation ends as
+    soon as the filter sees the model writing the candidate's turn. The profile sets the stop
+    sequences and the grammar of the output. When cancel fires the generation is aborted and
+    GenerationCancelled raised. user is the authenticated user the generation is scheduled for.
+    """
+    profile = profile or get_profile(None)
+    stream = on_token
+    if output_filter is not None:
+        on_token = filter_tokens(output_filter, stream)
+    response = response_cache.get(cache_key) if cache_key is not None else None
+    if cache_key is not None:
+        RESPONSE_CACHE.labels(profile.mode, "miss" if response is None else "hit").inc()
+    if response is not None:
+        logger.info(f"Response cache hit for session {session_id}")
+        if on_token is not None:
+            on_token(response["choices"][0]["text"])
+    else:
+        submitted = time.perf_counter()
+        try:
+            response = wait_for(submit_model(session_id, prompt, max_tokens, on_token, profile, cancel, user), cancel)
+        except GenerationCancelled as e:
+            GENERATION_ERRORS.labels(profile.mode, e.reason).inc()
+            raise
+        except EngineOverloadedError:
+            GENERATION_ERRORS.labels(profile.mode, "overloaded").inc()
+            raise
+        except HTTPException:
+            GENERATION_ERRORS.labels(profile.mode, "not_ready").inc()
+            raise
+        except Exception:
+            GENERATION_ERRORS.labels(profile.mode, "failed").inc()
+            raise
+        observe_generation(profile.mode, submitted, response)
+    if output_filter is not None:
+        rest = output_filter.finish()
+        if rest and stream is not None:
+            stream(rest)
+        response = {**response, "choices": [{**response["choices"][0], "text": output_filter.text}]}
+    if cache_key is not None:
+        response_cache.put(cache_key, response)
+    return response
+
+def generate(model, prompt: str, max_tokens: int, on_token=None, profile=None, cancel=None):
+    """
+    Run a completion, streaming it to on_token if given. The generation ends early when on_token returns True,
+    and raises GenerationCancelled when cancel fires.
+    Besides the text the response reports the token counts and perf_counter timestamps of the generation.
+    """
+    profile = profile or get_profile(None)
+    options = {"max_tokens": max_tokens, "stop": list(profile.stop), "grammar": profile.grammar}
+    if cancel is not None:
+        options["stopping_criteria"] = cancel.stopping_criteria()
+    started = time.perf_counter()
+    # llama.cpp times prompt evaluation and decoding itself, so the plain call needs no streaming to be measured.
+    # Stand-in models without a llama context (see benchmarks/fake_llama.py) report no first token time.
+    timed = isinstance(model, llama_cpp.Llama)
+    if timed:
+        llama_cpp.llama_perf_context_reset(model.ctx)
+    if on_token is None:
+        response = model(prompt, **options)
+    else:
+        text = ""
+        finish_reason = None
+        chunks = model(prompt, stream=True, **options)
+        for chunk in chunks:
+            choice = chunk["choices"][0]
+            token = choice.get("text", "")
+            if token:
+                text += token
+                if on_token(token):
+                    finish_reason = "stop"
+                    break
+            finish_reason = choice.get("finish_reason") or finish_reason
+        chunks.close()
+        prompt_tokens = len(model.tokenize(prompt.encode("utf-8"), add_bos=True, special=True))
+        completion_tokens = len(model.tokenize(text.encode("utf-8"), add_bos=False)) if text else 0
+        response = {
+            "choices": [{"text": text, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+    if cancel is not None:
+        # Drop the text of an aborted generation
+        cancel.check()
+    first_token = started + llama_cpp.llama_perf_context(model.ctx).t_p_eval_ms / 1000 if timed else None
+    response["usage"]["prompt_tokens_reused"] = 0
+    response["timings"] = {"started": started, "first_token": first_token, "finished": time.perf_counter()}
+    return response
+
+def save_turn_state(session):
+    """Copy of the session fields a turn changes, to put back if the turn is cancelled or fails."""
+    return {key: copy.copy(session.get(key)) for key in TURN_STATE_KEYS}
+
+def discard_turn(session, turn_state, user_input: str):
+    """Undo a turn that was cancelled or failed: restore the session fields and drop its user entry."""
+    session.update(turn_state)
+    with history_lock:
+        history = session["history"]
+        if is_current_turn(history, user_input):
+            history.pop()
+
+def prompt_model_static(session_id: str, user_input: str, on_token=None, cancel=None, user=None):
+    """
+    Run a chat turn and commit everything it changed in the session to the session store as one
+    update, then summarize the history in the background if it grew too long.
+    """
+    session = get_chat_history(session_id)
+    turn_count, history_length = session.get("turn_count", 0), len(session["history"])
+    response = run_turn(session_id, session, user_input, on_token, cancel, user)
+    session["turn_count"] = turn_count + 1
+    try:
+        try:
+            chat_sessions.commit(session_id, session)
+        except VersionConflict:
+            session = rebase_turn(session_id, session, turn_count, history_length)
+    except VersionConflict:
+        logger.warning(f"Session {session_id} was committed by another request during the turn, discarding the turn")
+        raise HTTPException(status_code=409, detail="The session was changed by another request, please try again.")
+    schedule_compaction(session_id, session)
+    return response
+
+def rebase_turn(session_id: str, session, turn_count: int, history_length: int):
+    """
+    Commit a turn whose session was changed since the turn read it. If only the background summary
+    changed it, the turn's new history entries and fields are applied to the latest state; if
+    another turn was committed, VersionConflict is raised. Returns the committed session.
+    """
+    entries = session["history"][history_length:]
+    rebased = None
+
+    def apply_turn(latest):
+        nonlocal rebased
+        if latest.get("turn_count", 0) != turn_count:
+            raise VersionConflict(session_id)
+        latest["history"].extend(entries)
+        latest.update({key: value for key, value in session.items() if key not in ("history", *SUMMARY_KEYS, *TRANSIENT_KEYS)})
+        rebased = latest
+    chat_sessions.update(session_id, apply_turn)
+    logger.info(f"Applied the turn of session {session_id} on top of its history summary")
+    return rebased
+
+def run_turn(session_id: str, session, user_input: str, on_token=None, cancel=None, user=None):
+    turn_state = save_turn_state(session)
     try:
         logger.info(f"Received request: session_id={session_id}, user_input={user_input}")
-        session = get_chat_history(session_id)
         chat_history = session["history"]
         job_description = session.get("job_description", None)
         is_interview_mode = session.get("is_interview_mode", False)
@@ -156,24 +802,21 @@ def prompt_model_static(session_id: str, user_input: str):
         max_questions = session.get("max_questions", 3)
         summary_points = session.get("summary_points", [])
 
+        # Keep the mode for the whole session so the system prompt does not change between turns
+        mode = detect_mode(user_input)
+        if mode is not None:
+            session["mode"] = mode
+
         # Handle /q quit command
         if user_input.strip().lower() == "/q":
             session["is_interview_mode"] = False
             session["interview_state"] = None
+            session["mode"] = None
             session["questions_asked"] = 0
             session["summary_points"] = []
-            chat_history.append(f"User: {user_input}")
-            quit_message = (
-                "You have exited all modes. Available commands:\n"
-                "/interview - Start interview simulation\n"
-                "/quiz - Start quiz mode\n"
-                "/training - Start training mode\n"
-                "/selfcheck - Self check mode\n"
-                "/help - List all commands\n\n"
-                "Please enter a command to begin."
-            )
-            chat_history.append(f"AI: {quit_message}")
-            return {"response": quit_message}
+            chat_history.append(Turn(USER, user_input))
+            chat_history.append(Turn(ASSISTANT, QUIT_MESSAGE))
+            return {"response": QUIT_MESSAGE}
 
         # Check if this is an interview command
         if "/interview" in user_input.lower():
@@ -181,74 +824,138 @@ def prompt_model_static(session_id: str, user_input: str):
             session["interview_state"] = "in_progress"
             session["questions_asked"] = 0
             session["summary_points"] = []
-            chat_history.append(f"User: {user_input}")
-            logger.info("Calling model for first interview question...")
-            prompt = build_llama3_prompt(session, user_input)
-            token_budget = max(200, min(600, 4096 - len(prompt.split())))
-            response = model(prompt, max_tokens=token_budget)
-            logger.info(f"Raw model response: {response}")
-            if "choices" not in response or not response["choices"]:
-                logger.error("LLM did not return a valid response!")
-                raise HTTPException(status_code=500, detail="LLM did not return a valid response.")
-            ai_response = response["choices"][0]["text"].strip()
-            ai_response = validate_interview_response(ai_response)
-            logger.info(f"First interview model output: {ai_response}")
-            if not ai_response:
-                logger.warning("Model returned empty response, using fallback question.")
-                ai_response = "Let's begin the interview. Can you tell me about a challenging project you worked on and how you overcame it?"
+            session["bank_questions_asked"] = []
+            chat_history.append(Turn(USER, user_input))
+            question = next_bank_question(session)
+            if question is not None:
+                # The question bank is ready: open right away, the model takes over from the first answer
+                ai_response = f"Let's begin the interview. {question}"
+                logger.info(f"First interview question from the question bank for session {session_id}")
+                if on_token is not None:
+                    on_token(ai_response)
+            else:
+                # Bank of a job description stored before the model was loaded, or one that failed before
+                schedule_question_bank(session_id, job_description)
+                logger.info("Calling model for first interview question...")
+                prompt, token_budget = prepare_prompt(session, user_input)
+                profile = get_profile("interview")
+                response = run_model(session_id, prompt, token_budget, on_token, response_cache_key(session, token_budget, profile),
+                                     output_filter=ResponseFilter(), profile=profile, cancel=cancel, user=user)
+                logger.info(f"Raw model response: {response}")
+                if "choices" not in response or not response["choices"]:
+                    logger.error("LLM did not return a valid response!")
+                    raise HTTPException(status_code=500, detail="LLM did not return a valid response.")
+                ai_response = response["choices"][0]["text"].strip()
+                logger.info(f"First interview model output: {ai_response}")
+                if not ai_response:
+                    logger.warning("Model returned empty response, using fallback question.")
+                    ai_response = "Let's begin the interview. Can you tell me about a challenging project you worked on and how you overcame it?"
             session["questions_asked"] += 1
-            chat_history.append(f"AI: {ai_response}")
+            chat_history.append(Turn(ASSISTANT, ai_response))
             logger.info(f"AI Response generated for session {session_id}")
             return {"response": ai_response}
 
         # Store first user input as job description
         if job_description is None:
-            store_job_description(session_id, user_input)
-            return {"response": "Thank you for providing the job description. What would you like to do next?"}
+            store_job_description(session_id, user_input, session)
+            return {"response": JOB_DESCRIPTION_ACK}
 
         # If in interview mode, enforce strict logic
         if session["is_interview_mode"]:
             # If interview just started or in progress
             if session["interview_state"] == "in_progress":
                 # Add user input to history
-                chat_history.append(f"User: {user_input}")
+                chat_history.append(Turn(USER, user_input))
+                # The answer to the last question comes back as JSON with the feedback and the summary
+                is_last_question = session["questions_asked"] + 1 >= max_questions
+                profile = get_profile("interview_summary" if is_last_question else "interview")
                 # Build prompt for Llama 3
-                prompt = build_llama3_prompt(session, user_input)
-                token_budget = max(200, min(600, 4096 - len(prompt.split())))
-                response = model(prompt, max_tokens=token_budget)
+                max_response_tokens = settings.INTERVIEW_SUMMARY_MAX_TOKENS if is_last_question else MAX_RESPONSE_TOKENS
+                prompt, token_budget = prepare_prompt(session, user_input, profile, max_response_tokens)
+                cache_key = response_cache_key(session, token_budget, profile)
+                if is_last_question:
+                    response = run_model(session_id, prompt, token_budget, cache_key=cache_key, profile=profile, cancel=cancel,
+                                         user=user)
+                else:
+                    try:
+                        response = run_model(session_id, prompt, token_budget, on_token, cache_key,
+                                             output_filter=ResponseFilter(), profile=profile, cancel=cancel, user=user)
+                    except EngineOverloadedError:
+                        # Keep the interview going with the next question of the bank instead of failing the turn
+                        question = next_bank_question(session)
+                        if question is None:
+                            raise
+                        logger.info(f"Inference queue is full, asking a question bank question in session {session_id}")
+                        response = {"choices": [{"text": question}]}
+                        if on_token is not None:
+                            on_token(question)
                 if "choices" not in response or not response["choices"]:
                     logger.error("LLM did not return a valid response!")
                     raise HTTPException(status_code=500, detail="LLM did not return a valid response.")
                 ai_response = response["choices"][0]["text"].strip()
-                ai_response = validate_interview_response(ai_response)
+                if not ai_response and not is_last_question:
+                    ai_response = next_bank_question(session) or ""
+                    if ai_response and on_token is not None:
+                        on_token(ai_response)
                 # If this is the last question, mark as finished and add summary
                 session["questions_asked"] += 1
-                if session["questions_asked"] >= max_questions:
+                if is_last_question:
                     session["interview_state"] = "finished"
-                    # Extract summary points
-                    summary = extract_summary_points(ai_response)
-                    session["summary_points"].append(summary)
-                    ai_response += f"\n\nHere is your interview summary:\n{summary}"
+                    parsed = parse_interview_summary(ai_response)
+                    if parsed is None:
+                        GENERATION_ERRORS.labels(profile.mode, "invalid_output").inc()
+                        logger.warning(f"Interview summary for session {session_id} is not valid JSON: {ai_response}")
+                        # Whatever the model wrote is closer to an answer than a canned line
+                        output_filter = ResponseFilter()
+                        output_filter.feed(ai_response)
+                        output_filter.finish()
+                        ai_response = output_filter.text
+                        session["summary_points"].append(NO_SUMMARY)
+                    else:
+                        summary = format_interview_summary(parsed)
+                        session["summary_points"].append(summary)
+                        ai_response = parsed["feedback"].strip() + f"\n\nHere is your interview summary:\n{summary}"
+                    if on_token is not None:
+                        on_token(ai_response)
                 # Add AI response to history
-                chat_history.append(f"AI: {ai_response}")
+                chat_history.append(Turn(ASSISTANT, ai_response))
                 logger.info(f"AI Response generated for session {session_id}")
                 return {"response": ai_response}
             elif session["interview_state"] == "finished":
-                return {"response": "The interview has concluded. If you want to start over, type /interview again."}
+                return {"response": INTERVIEW_CONCLUDED}
         # Not in interview mode: normal chat
-        chat_history.append(f"User: {user_input}")
-        prompt = build_llama3_prompt(session, user_input)
-        token_budget = max(200, min(600, 4096 - len(prompt.split())))
-        response = model(prompt, max_tokens=token_budget)
+        chat_history.append(Turn(USER, user_input))
+        prompt, token_budget = prepare_prompt(session, user_input)
+        profile = get_profile(session.get("mode"))
+        response = run_model(session_id, prompt, token_budget, on_token, response_cache_key(session, token_budget, profile),
+                             profile=profile, cancel=cancel, user=user)
         if "choices" not in response or not response["choices"]:
             logger.error("LLM did not return a valid response!")
             raise HTTPException(status_code=500, detail="LLM did not return a valid response.")
         ai_response = response["choices"][0]["text"].strip()
-        chat_history.append(f"AI: {ai_response}")
+        chat_history.append(Turn(ASSISTANT, ai_response))
         logger.info(f"AI Response generated for session {session_id}")
         return {"response": ai_response}
     except HTTPException:
+        # Nothing of a failed turn stays in the session, so a retry starts from the same state
+        discard_turn(session, turn_state, user_input)
         raise
+    except GenerationCancelled as e:
+        # Nothing of the cancelled turn stays in the session, the user can send it again
+        discard_turn(session, turn_state, user_input)
+        logger.info(f"Generation for session {session_id} cancelled ({e.reason})")
+        if e.reason == "deadline":
+            raise HTTPException(status_code=504, detail="The interview coach took too long to answer, please try again.")
+        raise HTTPException(status_code=499, detail="The client closed the request.")
+    except EngineOverloadedError as e:
+        discard_turn(session, turn_state, user_input)
+        logger.warning(f"Rejected request for session {session_id}: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail="The interview coach is busy, please try again shortly.",
+            headers={"Retry-After": "5"}
+        )
     except Exception as e:
+        discard_turn(session, turn_state, user_input)
         logger.error(f"Error in prompt_model_static: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to generate AI response")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to generate AI response")
@@ -0,0 +1,292 @@
+from concurrent.futures import Future
+import codecs
+import logging
+import queue
+import random
+import threading
+import time
+
+import llama_cpp
+from llama_cpp._internals import LlamaBatch, LlamaSampler
+
+from inference.cancellation import GenerationCancelled
+from inference.engine import EngineOverloadedError
+from inference.scheduler import FairQueue, ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+class Generation:
+    """One completion request moving through the batched engine."""
+
+    def __init__(self, prompt_tokens, max_tokens: int, temperature: float, stop, grammar, on_token, cancel, future: Future):
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = [s for s in (stop or []) if s]
+        self.grammar = grammar
+        self.on_token = on_token
+        self.cancel = cancel
+        self.future = future
+        self.pending = []           # Prompt tokens not yet evaluated
+        self.next_token = None      # Sampled token that still has to be evaluated
+        self.completion_tokens = 0
+        self.text = ""
+        self.emitted = 0            # Characters of text already passed to on_token
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.sampler = None
+        self.prompt_tokens_reused = 0
+        self.started = None         # perf_counter timestamps of admission, first token and end
+        self.first_token = None
+
+    def build_sampler(self, model):
+        sampler = LlamaSampler()
+        if self.grammar is not None:
+            sampler.add_grammar(model, self.grammar)
+        if self.temperature == 0.0:
+            sampler.add_greedy()
+        else:
+            # Same chain and defaults as Llama.__call__
+            sampler.add_top_k(40)
+            sampler.add_typical(1.0, 1)
+            sampler.add_top_p(0.95, 1)
+            sampler.add_min_p(0.05, 1)
+            sampler.add_temp(self.temperature)
+            sampler.add_dist(random.getrandbits(32))
+        self.sampler = sampler
+
+    def add_text(self, piece: bytes) -> bool:
+        """Append a decoded piece, stream what is safe to stream and return True once the generation should end."""
+        self.text += self.decoder.decode(piece)
+        for stop in self.stop:
+            index = self.text.find(stop)
+            if index != -1:
+                self.text = self.text[:index]
+                self.flush(len(self.text))
+                return True
+        # Hold back a tail that could still turn into a stop sequence
+        held = 0
+        for stop in self.stop:
+            for length in range(min(len(stop) - 1, len(self.text)), 0, -1):
+                if self.text.endswith(stop[:length]):
+                    held = max(held, length)
+                    break
+        return self.flush(len(self.text) - held)
+
+    def flush(self, end: int) -> bool:
+        """Stream the text up to end. Returns True when on_token asks to end the generation."""
+        stop = False
+        if self.on_token is not None and end > self.emitted:
+            stop = bool(self.on_token(self.text[self.emitted:end]))
+        self.emitted = max(self.emitted, end)
+        return stop
+
+    def response(self, finish_reason: str):
+        self.flush(len(self.text))
+        return {
+            "choices": [{"text": self.text, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": len(self.prompt_tokens),
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": len(self.prompt_tokens) + self.completion_tokens,
+                "prompt_tokens_reused": self.prompt_tokens_reused,
+            },
+            "timings": {"started": self.started, "first_token": self.first_token, "finished": time.perf_counter()},
+        }
+
+class Slot:
+    """Sequence id of the shared context and the tokens its KV cache currently holds."""
+
+    def __init__(self, seq_id: int):
+        self.seq_id = seq_id
+        self.tokens = []
+        self.generation = None
+
+class BatchedEngine:
+    """
+    Continuous batching on a single llama context.
+
+    Every running generation owns one sequence id of the context. A scheduler thread builds one
+    batch per step from the next token of every decoding sequence plus prompt chunks of newly
+    admitted ones, so all sequences advance with a single llama_decode. Finished sequences are
+    retired and queued requests admitted between steps, in the order of the FairQueue. An idle
+    sequence keeps its KV cache and is handed to the request whose prompt shares the longest
+    prefix with it, which is usually the next turn of the same session or a session in the same mode.
+    """
+
+    def __init__(self, model, context, queue_size: int):
+        self.model = model
+        self.context = context
+        self.batch_size = context.params.n_batch
+        self.slots = [Slot(seq_id) for seq_id in range(context.params.n_seq_max)]
+        # The KV cache is shared, every sequence gets an equal part of it
+        self.sequence_size = context.n_ctx() // len(self.slots)
+        self.batch = LlamaBatch(n_tokens=self.batch_size, embd=0, n_seq_max=1, verbose=False)
+        self.jobs = FairQueue(maxsize=queue_size)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="batched-inference", daemon=True)
+        self.thread.start()
+        logger.info(f"Batched inference engine started with {len(self.slots)} sequences and a queue of {queue_size}")
+
+    def tokenize(self, text: str):
+        return self.model.tokenize(text.encode("utf-8"), add_bos=True, special=True)
+
+    def submit_generation(self, prompt: str, max_tokens: int, on_token=None, temperature: float = 0.8, stop=None,
+                          grammar=None, cancel=None, priority: str = "chat", user: str = None) -> Future:
+        tokens = self.tokenize(prompt)
+        if len(tokens) >= self.sequence_size:
+            raise ValueError(f"Prompt of {len(tokens)} tokens does not fit a sequence of {self.sequence_size} tokens")
+        max_tokens = min(max_tokens, self.sequence_size - len(tokens))
+        future = Future()
+        generation = Generation(tokens, max_tokens, temperature, stop, grammar, on_token, cancel, future)
+        try:
+            self.jobs.put_nowait(ScheduledJob(generation, priority, user, max_tokens))
+        except queue.Full:
+            raise EngineOverloadedError(f"Inference queue is full ({self.jobs.maxsize} waiting requests)")
+        return future
+
+    def queue_depth(self) -> int:
+        return self.jobs.qsize()
+
+    def active_sequences(self) -> int:
+        return sum(1 for slot in self.slots if slot.generation is not None)
+
+    def shutdown(self):
+        self.stopped = True
+        self.jobs.put(None)
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped:
+            self.admit(block=self.active_sequences() == 0)
+            if self.active_sequences():
+                self.step()
+
+    def admit(self, block: bool):
+        while any(slot.generation is None for slot in self.slots):
+            try:
+                generation = self.jobs.get(timeout=1.0) if block else self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            block = False
+            if generation is None:
+                return
+            # Skip requests whose caller cancelled them while they were queued
+            if not generation.future.set_running_or_notify_cancel():
+                continue
+            self.assign_slot(generation)
+
+    def assign_slot(self, generation: Generation):
+        tokens = generation.prompt_tokens
+        best_slot, best_prefix = None, -1
+        for slot in self.slots:
+            if slot.generation is not None:
+                continue
+            prefix = 0
+            for cached, token in zip(slot.tokens, tokens):
+                if cached != token:
+                    break
+                prefix += 1
+            if prefix > best_prefix:
+                best_slot, best_prefix = slot, prefix
+        # Evaluate at least the last prompt token so there are logits to sample from
+        prefix = min(best_prefix, len(tokens) - 1)
+        self.context.kv_cache_seq_rm(best_slot.seq_id, prefix, -1)
+        best_slot.tokens = tokens[:prefix]
+        generation.pending = tokens[prefix:]
+        generation.prompt_tokens_reused = prefix
+        generation.started = time.perf_counter()
+        generation.build_sampler(self.model)
+        best_slot.generation = generation
+        logger.debug(f"Sequence {best_slot.seq_id}: reusing {prefix} of {len(tokens)} prompt tokens")
+
+    def add_token(self, slot: Slot, token: int, logits: bool):
+        batch = self.batch.batch
+        index = batch.n_tokens
+        batch.token[index] = token
+        batch.pos[index] = len(slot.tokens)
+        batch.seq_id[index][0] = slot.seq_id
+        batch.n_seq_id[index] = 1
+        batch.logits[index] = logits
+        batch.n_tokens += 1
+        slot.tokens.append(token)
+        return index
+
+    def step(self):
+        # Cancelled sequences leave before the batch is built, their evaluated tokens stay cached
+        for slot in self.slots:
+            cancel = slot.generation.cancel if slot.generation is not None else None
+            if cancel is not None and cancel.cancelled():
+                self.retire(slot, error=GenerationCancelled(cancel.reason))
+        if not self.active_sequences():
+            return
+        self.batch.reset()
+        sampled = []
+        # Decoding sequences go first, one token each, so they advance every step
+        for slot in self.slots:
+            generation = slot.generation
+            if generation is not None and generation.next_token is not None:
+                sampled.append((slot, self.add_token(slot, generation.next_token, True)))
+                generation.next_token = None
+        # Fill the rest of the batch with prompt chunks of admitted sequences
+        for slot in self.slots:
+            generation = slot.generation
+            if generation is None or not generation.pending:
+                continue
+            space = self.batch_size - self.batch.batch.n_tokens
+            if space <= 0:
+                break
+            chunk, generation.pending = generation.pending[:space], generation.pending[space:]
+            for i, token in enumerate(chunk):
+                index = self.add_token(slot, token, not generation.pending and i == len(chunk) - 1)
+            if not generation.pending:
+                sampled.append((slot, index))
+        try:
+            self.context.decode(self.batch)
+        except Exception as e:
+            logger.error(f"Batched decode of {self.batch.batch.n_tokens} tokens failed: {str(e)}")
+            for slot, _ in sampled:
+                self.retire(slot, error=e)
+            # Tokens of sequences that were still evaluating their prompt are lost as well
+            for slot in self.slots:
+                if slot.generation is not None and slot.generation.pending:
+                    self.retire(slot, error=e)
+            return
+        for slot, index in sampled:
+            self.sample(slot, index)
+
+    def sample(self, slot: Slot, index: int):
+        generation = slot.generation
+        token = generation.sampler.sample(self.context, index)
+        if generation.first_token is None:
+            generation.first_token = time.perf_counter()
+        if llama_cpp.llama_token_is_eog(self.model.vocab, token):
+            self.retire(slot, "stop")
+            return
+        generation.completion_tokens += 1
+        try:
+            stopped = generation.add_text(self.model.detokenize([token]))
+        except Exception as e:
+            self.retire(slot, error=e)
+            return
+        if stopped:
+            self.retire(slot, "stop")
+        elif generation.completion_tokens >= generation.max_tokens:
+            self.retire(slot, "length")
+        else:
+            generation.next_token = token
+
+    def retire(self, slot: Slot, finish_reason: str = None, error: Exception = None):
+        generation = slot.generation
+        slot.generation = None
+        generation.sampler.close()
+        if error is not None:
+            if not isinstance(error, GenerationCancelled):
+                # The cache of a failed sequence is in an unknown state
+                self.context.kv_cache_seq_rm(slot.seq_id, -1, -1)
+                slot.tokens = []
+            generation.future.set_exception(error)
+            return
+        try:
+            generation.future.set_result(generation.response(finish_reason))
+        except Exception as e:
+            generation.future.set_exception(e)
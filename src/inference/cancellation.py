@@ -0,0 +1,80 @@
+from concurrent.futures import CancelledError, Future, TimeoutError
+import threading
+import time
+
+from llama_cpp import StoppingCriteriaList
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is aborted because the client went away or the request ran past its deadline."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Generation cancelled ({reason})")
+        self.reason = reason
+
+class CancelToken:
+    """
+    Cancellation signal of one request, shared by the endpoint and the thread that generates.
+
+    The endpoint cancels the token when the client disconnects, the deadline cancels it by
+    itself. Generation loops poll cancelled() between tokens; work that is still queued is
+    dropped through the callbacks registered with on_cancel.
+    """
+
+    def __init__(self, timeout: float = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = "disconnected"):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def cancelled(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        return self.reason is not None
+
+    def check(self):
+        if self.cancelled():
+            raise GenerationCancelled(self.reason)
+
+    def remaining(self):
+        """Seconds until the deadline, None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def stopping_criteria(self) -> StoppingCriteriaList:
+        """Stopping criteria that end a llama_cpp completion once the token is cancelled."""
+        return StoppingCriteriaList([lambda input_ids, logits: self.cancelled()])
+
+def wait_for(future: Future, cancel: CancelToken = None):
+    """
+    Result of a generation future. Once cancel fires, a generation that is still queued is dropped
+    and GenerationCancelled raised right away; a running one raises it as soon as its loop notices.
+    """
+    if cancel is None:
+        return future.result()
+    cancel.on_cancel(future.cancel)
+    try:
+        try:
+            return future.result(timeout=cancel.remaining())
+        except TimeoutError:
+            # Deadline passed: fires the callbacks, the generation aborts at its next token
+            cancel.cancelled()
+            return future.result()
+    except CancelledError:
+        raise GenerationCancelled(cancel.reason)
@@ -0,0 +1,76 @@
+from concurrent.futures import Future
+import threading
+import logging
+import queue
+
+from inference.scheduler import FairQueue, ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+class EngineOverloadedError(Exception):
+    """Raised when the request queue of the inference engine is full."""
+
+class InferenceWorker(threading.Thread):
+    """Thread that owns one model context and runs jobs from the shared queue on it."""
+
+    def __init__(self, name: str, model, jobs: queue.Queue):
+        super().__init__(name=name, daemon=True)
+        self.model = model
+        self.jobs = jobs
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                fn, args, kwargs, future = job
+                # Skip jobs whose caller cancelled them while they were queued
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(self.model, *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            finally:
+                self.jobs.task_done()
+
+class InferenceEngine:
+    """
+    Pool of model workers behind a bounded request queue.
+
+    Every worker has its own llama context, so up to worker_count generations run in parallel.
+    Jobs are callables that receive the worker's model as first argument; submit returns a
+    Future per request that async callers can await with asyncio.wrap_future. Queued jobs are
+    taken by priority class and fair share of their user, see FairQueue.
+    """
+
+    def __init__(self, model_factory, worker_count: int, queue_size: int, warm_up=None):
+        self.jobs = FairQueue(maxsize=queue_size)
+        self.workers = []
+        for index in range(worker_count):
+            model = model_factory()
+            # Run a first generation on every context before it takes requests
+            if warm_up is not None:
+                warm_up(model)
+            worker = InferenceWorker(f"inference-worker-{index}", model, self.jobs)
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"Inference engine started with {worker_count} workers and a queue of {queue_size}")
+
+    def submit(self, fn, *args, priority: str = "chat", user: str = None, cost: float = 1.0, **kwargs) -> Future:
+        future = Future()
+        try:
+            self.jobs.put_nowait(ScheduledJob((fn, args, kwargs, future), priority, user, cost))
+        except queue.Full:
+            raise EngineOverloadedError(f"Inference queue is full ({self.jobs.maxsize} waiting requests)")
+        return future
+
+    def queue_depth(self) -> int:
+        return self.jobs.qsize()
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,90 @@
+from pathlib import Path
+import os
+
+# Fields of /proc/<pid>/smaps(_rollup), in kB
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+def parse_smaps_fields(lines, totals: dict):
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in SMAPS_FIELDS:
+            totals[name] = totals.get(name, 0) + int(value.split()[0]) * 1024
+
+def summarize(totals: dict) -> dict:
+    """Bytes resident, shared with other processes, private to this one and the proportional share."""
+    return {
+        "rss": totals.get("Rss", 0),
+        "shared": totals.get("Shared_Clean", 0) + totals.get("Shared_Dirty", 0),
+        "private": totals.get("Private_Clean", 0) + totals.get("Private_Dirty", 0),
+        "pss": totals.get("Pss", 0),
+    }
+
+def process_memory(pid="self") -> dict:
+    """Memory of a whole process. Empty on systems without /proc (e.g. Windows and macOS)."""
+    totals = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as file:
+            parse_smaps_fields(file, totals)
+    except OSError:
+        return {}
+    return summarize(totals)
+
+def mapped_file_memory(path: str, pid="self") -> dict:
+    """Memory of the mappings of one file in a process, e.g. the memory-mapped model weights."""
+    path = str(Path(path).resolve())
+    totals = {}
+    in_mapping = False
+    try:
+        with open(f"/proc/{pid}/smaps", encoding="utf-8") as file:
+            for line in file:
+                fields = line.split()
+                # Mapping headers start with an address range like 7f0c2a000000-7f0c2b000000
+                if fields and "-" in fields[0] and ":" not in fields[0]:
+                    in_mapping = len(fields) >= 6 and fields[5] == path
+                elif in_mapping:
+                    parse_smaps_fields((line,), totals)
+    except OSError:
+        return {}
+    return summarize(totals)
+
+def processes_mapping(path: str):
+    """Pids of all processes that have the file mapped, e.g. every uvicorn worker serving the model."""
+    path = str(Path(path).resolve())
+    pids = []
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            with (entry / "maps").open(encoding="utf-8") as file:
+                if any(line.rstrip("\n").endswith(path) for line in file):
+                    pids.append(int(entry.name))
+        except OSError:
+            continue
+    return sorted(pids)
+
+def memory_report(model_path: str) -> dict:
+    return {
+        "pid": os.getpid(),
+        "process": process_memory(),
+        "model": mapped_file_memory(model_path),
+    }
+
+def main():
+    """Print the memory of every process that maps the model, run from the src folder with python -m inference.memory"""
+    import setup_llama
+    model_path = setup_llama.llama_settings.LLAMA_MODEL_PATH
+    mib = 1024 * 1024
+    print(f"{'pid':>8}{'rss MiB':>10}{'shared MiB':>12}{'private MiB':>13}{'pss MiB':>10}{'model rss':>11}{'model shared':>14}")
+    total_pss = 0
+    for pid in processes_mapping(model_path):
+        process = process_memory(pid)
+        model = mapped_file_memory(model_path, pid)
+        if not process:
+            continue
+        total_pss += process["pss"]
+        print(f"{pid:>8}{process['rss'] / mib:>10.0f}{process['shared'] / mib:>12.0f}{process['private'] / mib:>13.0f}"
+              f"{process['pss'] / mib:>10.0f}{model['rss'] / mib:>11.0f}{model['shared'] / mib:>14.0f}")
+    print(f"Actual memory of all workers (sum of PSS): {total_pss / mib:.0f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 4, 6, 8, 10, 15, 20, 30, 50, 100)
+DATABASE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+PROMPT_TOKENS = Counter(
+    "interview_coach_prompt_tokens_total",
+    "Prompt tokens of model generations, split into tokens evaluated and tokens reused from a cached state",
+    ["mode", "cache"]
+)
+COMPLETION_TOKENS = Counter("interview_coach_completion_tokens_total", "Tokens generated by the model", ["mode"])
+QUEUE_WAIT = Histogram(
+    "interview_coach_queue_wait_seconds", "Time a generation waited for the inference engine", ["mode"], buckets=LATENCY_BUCKETS
+)
+PROMPT_EVAL = Histogram(
+    "interview_coach_prompt_eval_seconds", "Time from the start of a generation to its first token", ["mode"], buckets=LATENCY_BUCKETS
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "interview_coach_time_to_first_token_seconds", "Time from submitting a generation to its first token, including queue wait",
+    ["mode"], buckets=LATENCY_BUCKETS
+)
+DECODE = Histogram(
+    "interview_coach_decode_seconds", "Time from the first to the last token of a generation", ["mode"], buckets=LATENCY_BUCKETS
+)
+DECODE_RATE = Histogram(
+    "interview_coach_decode_tokens_per_second", "Decode speed of a generation", ["mode"], buckets=RATE_BUCKETS
+)
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "interview_coach_scheduler_queue_depth", "Jobs waiting for the inference engine", ["priority"], multiprocess_mode="livesum"
+)
+SCHEDULER_WAIT = Histogram(
+    "interview_coach_scheduler_wait_seconds", "Time a job waited in the scheduler queue before the engine took it",
+    ["priority"], buckets=LATENCY_BUCKETS
+)
+SESSIONS = Gauge("interview_coach_sessions", "Chat sessions held in memory", multiprocess_mode="livesum")
+SESSION_BYTES = Gauge("interview_coach_session_bytes", "Estimated memory held by chat sessions", multiprocess_mode="livesum")
+SESSION_SIZE = Histogram(
+    "interview_coach_session_size_bytes", "Estimated memory of a chat session after each change", buckets=SIZE_BUCKETS
+)
+SESSION_EVICTIONS = Counter("interview_coach_session_evictions_total", "Chat sessions dropped from memory", ["reason"])
+SESSION_LOAD = Histogram(
+    "interview_coach_session_load_seconds", "Time to read a chat session that is not in memory back from the database",
+    ["result"], buckets=DATABASE_BUCKETS
+)
+CHAT_TURNS = Counter(
+    "interview_coach_chat_turns_total",
+    "Chat requests, by whether they started a turn or attached to the same turn of their session still in flight", ["result"]
+)
+CHAT_TURN_WAIT = Histogram(
+    "interview_coach_chat_turn_wait_seconds", "Time a chat turn waited for the previous turn of its session", buckets=LATENCY_BUCKETS
+)
+RESPONSE_CACHE = Counter("interview_coach_response_cache_requests_total", "Response cache lookups", ["mode", "result"])
+GENERATION_ERRORS = Counter("interview_coach_generation_errors_total", "Generations that failed", ["mode", "reason"])
+
+def observe_generation(mode: str, submitted: float, response: dict):
+    """Record the token counts and timings an engine reported for one generation submitted at perf_counter time submitted."""
+    usage = response.get("usage", {})
+    timings = response.get("timings")
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    reused = usage.get("prompt_tokens_reused", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    PROMPT_TOKENS.labels(mode, "evaluated").inc(prompt_tokens - reused)
+    PROMPT_TOKENS.labels(mode, "reused").inc(reused)
+    COMPLETION_TOKENS.labels(mode).inc(completion_tokens)
+    if not timings:
+        return
+    started, first_token, finished = timings["started"], timings["first_token"], timings["finished"]
+    QUEUE_WAIT.labels(mode).observe(started - submitted)
+    if first_token is None:
+        return
+    PROMPT_EVAL.labels(mode).observe(first_token - started)
+    TIME_TO_FIRST_TOKEN.labels(mode).observe(first_token - submitted)
+    DECODE.labels(mode).observe(finished - first_token)
+    # The first token comes out of prompt evaluation, the others are decoded
+    if completion_tokens > 1 and finished > first_token:
+        DECODE_RATE.labels(mode).observe((completion_tokens - 1) / (finished - first_token))
+
+def render_metrics():
+    """Metrics in the Prometheus text format, merged over all worker processes when PROMETHEUS_MULTIPROC_DIR is set."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,74 @@
+import heapq
+import itertools
+import queue
+import time
+
+from inference.metrics import SCHEDULER_QUEUE_DEPTH, SCHEDULER_WAIT
+
+# Highest priority first: a candidate waits for the next interview question, background work can wait for everyone
+PRIORITY_CLASSES = ("interview", "practice", "chat", "background")
+
+class ScheduledJob:
+    """A queued job with what the scheduler orders it by."""
+
+    def __init__(self, item, priority: str = "chat", user: str = None, cost: float = 1.0):
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class {priority}")
+        self.item = item
+        self.priority = priority
+        self.user = user
+        self.cost = max(cost, 1.0)
+        self.enqueued_at = None
+
+class FairQueue(queue.Queue):
+    """
+    Job queue of the inference engines, ordered by priority class and per-user fair share.
+
+    Classes are served in strict order of PRIORITY_CLASSES. Within a class, jobs are ordered by
+    self-clocked weighted fair queuing keyed by user: every job gets a finish tag of
+    max(virtual time, the user's last finish tag) + cost, where the cost is the number of tokens
+    the job may generate, and the job with the lowest tag goes first. A user with many or long
+    jobs queued therefore gets in line behind the next job of every other user instead of ahead
+    of them. Put ScheduledJob entries; get returns the job's item.
+    """
+
+    def _init(self, maxsize: int):
+        self.heap = []
+        self.order = itertools.count()
+        self.virtual_time = {priority: 0.0 for priority in PRIORITY_CLASSES}
+        self.finish_tags = {}
+        self.depth = {priority: 0 for priority in PRIORITY_CLASSES}
+
+    def _qsize(self) -> int:
+        return len(self.heap)
+
+    def _put(self, job):
+        if job is None:
+            # Shutdown marker, ahead of everything
+            heapq.heappush(self.heap, (-1, 0.0, next(self.order), None))
+            return
+        key = (job.priority, job.user)
+        start = max(self.virtual_time[job.priority], self.finish_tags.get(key, 0.0))
+        finish = start + job.cost
+        self.finish_tags[key] = finish
+        job.enqueued_at = time.perf_counter()
+        heapq.heappush(self.heap, (PRIORITY_CLASSES.index(job.priority), finish, next(self.order), job))
+        self.depth[job.priority] += 1
+        SCHEDULER_QUEUE_DEPTH.labels(job.priority).inc()
+
+    def _get(self):
+        _, finish, _, job = heapq.heappop(self.heap)
+        if job is None:
+            return None
+        self.virtual_time[job.priority] = finish
+        self.depth[job.priority] -= 1
+        if not self.depth[job.priority]:
+            # Nobody of this class is waiting, old finish tags no longer matter
+            self.finish_tags = {key: tag for key, tag in self.finish_tags.items() if key[0] != job.priority}
+        SCHEDULER_QUEUE_DEPTH.labels(job.priority).dec()
+        SCHEDULER_WAIT.labels(job.priority).observe(time.perf_counter() - job.enqueued_at)
+        return job.item
+
+    def class_depths(self) -> dict:
+        with self.mutex:
+            return dict(self.depth)
@@ -0,0 +1,45 @@
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+import numpy as np
+
+SPECULATIVE_MODES = ("none", "prompt_lookup", "draft")
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Speculative draft from a small GGUF model that shares the main model's vocabulary
+    (e.g. Llama 3.2 1B for Llama 3.1 8B). Proposes num_pred_tokens greedy tokens per step,
+    which the main model then verifies in a single batch.
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int, n_threads: int, n_ctx: int):
+        self.num_pred_tokens = num_pred_tokens
+        self.model = Llama(
+            model_path=model_path,
+            n_threads=n_threads,
+            n_ctx=n_ctx,
+            verbose=False
+        )
+
+    def __call__(self, input_ids, **kwargs):
+        draft = []
+        # generate() reuses the longest matching prefix, so only the tokens accepted since the last call are evaluated
+        for token in self.model.generate(input_ids.tolist(), top_k=1, temp=0.0):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+def setup_draft_model(mode: str, num_pred_tokens: int, max_ngram_size: int = 2, draft_model_path: str = None,
+                      n_threads: int = 2, n_ctx: int = 2048):
+    """Draft model for llama_cpp's speculative decoding, None when it is turned off."""
+    if mode == "none":
+        return None
+    if mode == "prompt_lookup":
+        # Drafts continuations by matching the last n-gram against the prompt, free on CPU and a good fit
+        # for answers that repeat phrases from the job description and history
+        return LlamaPromptLookupDecoding(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+    if mode == "draft":
+        if not draft_model_path:
+            raise ValueError("Speculative mode 'draft' needs a draft model path")
+        return GGUFDraftModel(draft_model_path, num_pred_tokens, n_threads, n_ctx)
+    raise ValueError(f"Unknown speculative decoding mode '{mode}', expected one of {SPECULATIVE_MODES}")
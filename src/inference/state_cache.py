@@ -0,0 +1,70 @@
+from collections import OrderedDict
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+def compact_state(state):
+    """
+    Drop all but the last row of the saved logits.
+
+    Llama.save_state copies up to n_batch rows of logits (n_batch * n_vocab floats, about 250 MB
+    for Llama 3), but generation always re-evaluates the last prompt token, so one row is enough.
+    A single row also broadcasts back into the logits buffer in Llama.load_state.
+    """
+    if len(state.scores) > 1:
+        state.scores = state.scores[-1:].copy()
+    return state
+
+def state_size(state) -> int:
+    """Memory held by a saved state: KV cache data, logits and token ids."""
+    return state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
+
+class SessionStateCache:
+    """
+    LRU store of saved llama states (KV cache + evaluated tokens) keyed by session id.
+
+    Loading a session's state before generating lets llama_cpp match the prompt against the
+    tokens that were already evaluated, so only the newly appended turn has to be processed.
+    The total size of the stored states is kept below capacity_bytes.
+    """
+
+    def __init__(self, capacity_bytes: int):
+        self.capacity_bytes = capacity_bytes
+        self.size_bytes = 0
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str):
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is not None:
+                self._states.move_to_end(session_id)
+            return state
+
+    def put(self, session_id: str, state):
+        state = compact_state(state)
+        size = state_size(state)
+        with self._lock:
+            self._remove(session_id)
+            if size > self.capacity_bytes:
+                logger.warning(f"Llama state for session {session_id} ({size} bytes) exceeds the cache budget, not caching it")
+                return
+            while self._states and self.size_bytes + size > self.capacity_bytes:
+                evicted_id, evicted = self._states.popitem(last=False)
+                self.size_bytes -= state_size(evicted)
+                logger.debug(f"Evicted llama state for session {evicted_id}")
+            self._states[session_id] = state
+            self.size_bytes += size
+
+    def pop(self, session_id: str):
+        with self._lock:
+            self._remove(session_id)
+
+    def __len__(self):
+        return len(self._states)
+
+    def _remove(self, session_id: str):
+        state = self._states.pop(session_id, None)
+        if state is not None:
+            self.size_bytes -= state_size(state)
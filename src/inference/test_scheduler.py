@@ -0,0 +1,54 @@
+import pytest
+
+from inference.scheduler import FairQueue, ScheduledJob
+
+def drain(queue: FairQueue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+def test_classes_are_served_in_priority_order():
+    queue = FairQueue()
+    for priority in ("background", "chat", "practice", "interview"):
+        queue.put(ScheduledJob(priority, priority))
+    assert drain(queue) == ["interview", "practice", "chat", "background"]
+
+def test_users_take_turns_within_a_class():
+    queue = FairQueue()
+    for index in range(3):
+        queue.put(ScheduledJob(f"a{index}", user="a"))
+    queue.put(ScheduledJob("b0", user="b"))
+    queue.put(ScheduledJob("c0", user="c"))
+    assert drain(queue) == ["a0", "b0", "c0", "a1", "a2"]
+
+def test_long_jobs_wait_behind_short_ones_of_others():
+    queue = FairQueue()
+    queue.put(ScheduledJob("long", user="a", cost=600))
+    queue.put(ScheduledJob("short", user="b", cost=100))
+    assert drain(queue) == ["short", "long"]
+
+def test_equal_jobs_keep_arrival_order():
+    queue = FairQueue()
+    for index in range(5):
+        queue.put(ScheduledJob(index, user=f"user{index}"))
+    assert drain(queue) == [0, 1, 2, 3, 4]
+
+def test_shutdown_marker_goes_first():
+    queue = FairQueue()
+    queue.put(ScheduledJob("job", "interview"))
+    queue.put(None)
+    assert queue.get_nowait() is None
+    assert queue.get_nowait() == "job"
+
+def test_class_depths():
+    queue = FairQueue()
+    queue.put(ScheduledJob("x", "chat"))
+    queue.put(ScheduledJob("y", "chat"))
+    assert queue.class_depths()["chat"] == 2
+    queue.get_nowait()
+    assert queue.class_depths()["chat"] == 1
+
+def test_unknown_priority_class():
+    with pytest.raises(ValueError):
+        ScheduledJob("x", "urgent")
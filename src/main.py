@@ -1,22 +1,31 @@
 from fastapi import FastAPI, HTTPException, Depends, Request, Query, Response, Cookie
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from llama_cpp.server.errors import ErrorResponse
 from starlette import status
+import asyncio
+import functools
+import json
 import logging
 import sys
+import threading
+import time
 import traceback
 from typing import Callable
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 import mariadb
 
 from database.chat_history import save_chat_message, get_chat_history
 from database.job_description import create_job_description, get_job_description
-from get_model_response import prompt_model_static
+from get_model_response import prompt_model_static, load_models, model_status, model_memory
 from authentication.auth_controller import AuthController
 from models import TokenResponse, SignUpRequest, LoginRequest
 from database.sessions import create_session
+from chat_admission import chat_admission, chat_settings, AdmissionRejected
+from chat_turns import chat_turns
+from inference.metrics import render_metrics
 
 # Configure logging at the start of the file
 logging.basicConfig(
@@ -26,8 +35,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model in the background so auth and history endpoints are usable right after boot
+    threading.Thread(target=load_models, name="model-loader", daemon=True).start()
+    yield
+
 # Initialize FastAPI app
-app = FastAPI(title="Interview Coach API")
+app = FastAPI(title="Interview Coach API", lifespan=lifespan)
 
 # Initialize HTTPBearer security dependency
 bearer_scheme = HTTPBearer()
@@ -101,7 +116,7 @@ app.add_middleware(
 )
 
 @app.post("/auth/signup", response_model=TokenResponse)
-async def signup(request: SignUpRequest):
+def signup(request: SignUpRequest):
     try:
         logger.info("Signup request received")
         logger.info(f"Request data: {request.dict(exclude={'password'})}")
@@ -136,7 +151,7 @@ async def signup(request: SignUpRequest):
         )
 
 @app.post("/auth/login", response_model=TokenResponse)
-async def login(request: LoginRequest):
+def login(request: LoginRequest):
     try:
         logger.info("Login request received")
         logger.info(f"Email: {request.email}")
@@ -162,7 +177,7 @@ async def login(request: LoginRequest):
         )
 
 @app.post("/auth/refresh", response_model=TokenResponse)
-async def refresh_token(refresh_token: str = Cookie(None)):
+def refresh_token(refresh_token: str = Cookie(None)):
     if not refresh_token:
         raise HTTPException(status_code=401, detail="No refresh token provided")
     token_response = AuthController.refresh(refresh_token)
@@ -198,26 +213,108 @@ class SessionRequest(BaseModel):
 def read_root():
     return AuthController.read_root()
 
+### Health Endpoints ###
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the API process is up."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the model is loaded and warmed up, so /chat can answer."""
+    model = model_status()
+    if model != "ready":
+        return JSONResponse(status_code=503, content={"status": "not ready", "model": model})
+    return {"status": "ready", "model": model}
+
+@app.get("/metrics")
+def metrics():
+    """Inference metrics in the Prometheus text format."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/memory", responses={
+    401: {"model": ErrorResponse, "description": "Unauthorized"}
+})
+def memory(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    """Resident, shared and private memory of the worker process that answers, in bytes."""
+    # Process details are not for anonymous callers
+    AuthController.protected_endpoint(credentials)
+    return model_memory()
+
+def ensure_model_ready():
+    if model_status() != "ready":
+        raise HTTPException(
+            status_code=503,
+            detail="The interview coach is still starting up, please try again shortly.",
+            headers={"Retry-After": "10"}
+        )
+
 ### Chat Endpoints ###
+def save_turn(session_id: str, user_input: str, ai_response: str):
+    save_chat_message(session_id, "user", user_input)
+    save_chat_message(session_id, "ai", ai_response)
+
+# How often a running chat turn checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+async def watch_disconnect(http_request: Request, leave: Callable):
+    """Leave the turn once the client has gone away, its generation stops when nobody else waits for it."""
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    logger.info("Client disconnected, leaving its turn")
+    leave()
+
+async def run_chat_turn(session_id: str, user_input: str, user: str, on_token, cancel):
+    """Generate a chat turn and save its messages. Runs once per turn, however many requests are attached to it."""
+    response = await chat_admission.run(prompt_model_static, session_id, user_input, on_token, cancel, user)
+    await chat_admission.run(save_turn, session_id, user_input, response["response"])
+    return response
+
+def join_chat_turn(request: ChatRequest, user: str, stream: bool = False):
+    """
+    The chat turn of the request, run after the turns of its session that came before it, or the
+    same turn already in flight when the request is a double submit or a retry.
+    """
+    run = functools.partial(run_chat_turn, request.sessionId, request.userInput, user)
+    return chat_turns.join(request.sessionId, request.userInput, user, run, stream, chat_settings.CHAT_DEADLINE_SECONDS)
+
+def admission_rejected_error(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"The interview coach is busy ({e.pending} requests pending). Please retry in {e.retry_after} seconds.",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
 @app.post("/chat")
-async def chat(request: ChatRequest, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+async def chat(request: ChatRequest, http_request: Request, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
     try:
         if not request.userInput.strip():
             raise HTTPException(
                 status_code=400,
                 detail="Input cannot be empty."
             )
-        
-        # Verify token and get user info
-        user_info = AuthController.protected_endpoint(credentials)
-        
-        response = prompt_model_static(request.sessionId, request.userInput)
-        
-        # Save chat messages
-        save_chat_message(request.sessionId, "user", request.userInput)
-        save_chat_message(request.sessionId, "ai", response["response"])
-        return response
-        
+        ensure_model_ready()
+
+        # Blocking work (Keycloak, inference, MariaDB) runs on the chat pool, never on the event loop
+        async with chat_admission.admit():
+            # Verify token and get user info
+            user_info = await chat_admission.run(AuthController.protected_endpoint, credentials)
+
+            # The generation stops when every client of the turn has gone away or the deadline passes
+            turn = join_chat_turn(request, user_info.preferred_username)
+            leave = turn.attach()
+            watcher = asyncio.ensure_future(watch_disconnect(http_request, leave))
+            try:
+                # Shielded, the turn may have other clients
+                return await asyncio.shield(turn.task)
+            finally:
+                watcher.cancel()
+                leave()
+
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected chat request for session {request.sessionId}: {str(e)}")
+        raise admission_rejected_error(e)
     except HTTPException as e:
         logger.error(f"HTTP error in chat endpoint: {str(e)}")
         raise
@@ -228,12 +325,97 @@ async def chat(request: ChatRequest, credentials: HTTPAuthorizationCredentials =
             detail=f"Failed to send message: {str(e)}"
         )
 
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    Streaming response that calls on_close once it is finished with, also when the client went away
+    before the body was streamed and the body's generator never started.
+    """
+
+    def __init__(self, content, on_close: Callable, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    if not request.userInput.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="Input cannot be empty."
+        )
+    ensure_model_ready()
+
+    try:
+        position = chat_admission.acquire()
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected chat stream for session {request.sessionId}: {str(e)}")
+        raise admission_rejected_error(e)
+    started_at = time.monotonic()
+
+    try:
+        # Verify token and get user info
+        user_info = await chat_admission.run(AuthController.protected_endpoint, credentials)
+    except BaseException:
+        chat_admission.release(started_at)
+        raise
+
+    # The llama generation loop is blocking, so it runs on the chat pool and hands tokens over to the turn
+    turn = join_chat_turn(request, user_info.preferred_username, stream=True)
+    leave = turn.attach()
+
+    def close():
+        # The stream also ends early when the client disconnects, the generation must not outlive its clients
+        leave()
+        chat_admission.release(started_at)
+
+    async def event_stream():
+        watcher = asyncio.ensure_future(watch_disconnect(http_request, leave))
+        try:
+            if position > 0:
+                yield sse_event("queued", {"position": position})
+            # Starts with the tokens the turn streamed before this request attached to it
+            tokens = turn.subscribe()
+            while True:
+                token = await tokens.get()
+                if token is None:
+                    break
+                yield sse_event("token", {"token": token})
+            try:
+                response = turn.task.result()
+            except HTTPException as e:
+                logger.error(f"HTTP error in chat stream: {str(e)}")
+                yield sse_event("error", {"detail": e.detail})
+                return
+            except Exception as e:
+                logger.error(f"Error in chat stream: {str(e)}")
+                yield sse_event("error", {"detail": f"Failed to send message: {str(e)}"})
+                return
+            yield sse_event("done", response)
+        finally:
+            watcher.cancel()
+
+    return ClosingStreamingResponse(
+        event_stream(),
+        close,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 ### Database Endpoints ###
 @app.get("/chat/history/{session_id}", responses={
     401: {"model": ErrorResponse, "description": "Unauthorized"},
     500: {"model": ErrorResponse, "description": "Internal server error"}
 })
-async def get_history(session_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+def get_history(session_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
     try:
         # Verify token and get user info
         user_info = AuthController.protected_endpoint(credentials)
@@ -251,7 +433,7 @@ async def get_history(session_id: str, credentials: HTTPAuthorizationCredentials
     401: {"model": ErrorResponse, "description": "Unauthorized"},
     500: {"model": ErrorResponse, "description": "Internal server error"}
 })
-async def get_description(session_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+def get_description(session_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
     try:
         # Verify token and get user info
         user_info = AuthController.protected_endpoint(credentials)
@@ -269,7 +451,7 @@ async def get_description(session_id: str, credentials: HTTPAuthorizationCredent
     401: {"model": ErrorResponse, "description": "Unauthorized"},
     500: {"model": ErrorResponse, "description": "Internal server error"}
 })
-async def create_new_job_description(session_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+def create_new_job_description(session_id: str, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
     try:
         # Verify token and get user info
         user_info = AuthController.protected_endpoint(credentials)
@@ -284,7 +466,7 @@ async def create_new_job_description(session_id: str, credentials: HTTPAuthoriza
         )
 
 @app.post("/session")
-async def create_new_session(session_id: str = Query(..., min_length=1, description="The session ID to create"), credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+def create_new_session(session_id: str = Query(..., min_length=1, description="The session ID to create"), credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
     try:
         logger.info(f"Creating new session with session_id: {session_id}")
         
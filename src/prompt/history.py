@@ -0,0 +1,104 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+from prompt.prompt import LLAMA3_USER, LLAMA3_ASSISTANT
+
+# Roles of history turns. The job description turn only records when it was given, its text is in the system prompt.
+USER = "user"
+ASSISTANT = "assistant"
+JOB_DESCRIPTION = "job_description"
+
+LABELS = {USER: "User: ", ASSISTANT: "AI: ", JOB_DESCRIPTION: "User provided Job Description: "}
+
+@dataclass(slots=True)
+class Turn:
+    """One entry of a session's history. tokens caches the token count of its prompt block once it is counted."""
+    role: str
+    text: str
+    tokens: Optional[int] = field(default=None, compare=False)
+
+    def block(self):
+        """Llama 3 block of the turn, None for turns that are not part of the conversation."""
+        if self.role == USER:
+            return LLAMA3_USER.format(self.text)
+        if self.role == ASSISTANT:
+            return LLAMA3_ASSISTANT.format(self.text)
+        return None
+
+    def __str__(self):
+        return LABELS[self.role] + self.text
+
+def encode_turn(value):
+    """json.dumps default for sessions holding turns."""
+    if isinstance(value, Turn):
+        return {"turn": [value.role, value.text, value.tokens]}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def decode_turn(value: dict):
+    """json.loads object_hook that turns what encode_turn wrote back into turns."""
+    if len(value) == 1 and "turn" in value:
+        return Turn(*value["turn"])
+    return value
+
+class PromptBuffer:
+    """
+    Llama 3 text of the most recent turns of a session's history that fit into the prompt, kept
+    between turns so a turn only formats and counts the turns added since the last one.
+
+    update appends the new turns and drops the oldest ones while the text is over the token
+    limit. The buffer is built again from the history only when that was rewritten (summarized
+    or a cancelled turn taken back) or when the limit grew and older turns may fit again.
+
+    This only saves work with the memory session backend. The buffer is in TRANSIENT_KEYS of
+    session_store.py, so the sqlite and mariadb backends do not store it and every turn builds it
+    again from the whole history.
+    """
+
+    __slots__ = ("start", "end", "last", "text", "tokens", "limit")
+
+    def __init__(self):
+        self.start = 0  # first history turn in the text
+        self.end = 0  # history turns covered by the text
+        self.last = None  # the turn at end - 1, to notice a rewritten history
+        self.text = ""
+        self.tokens = 0
+        self.limit = None
+
+    def update(self, history, count_tokens, limit: Optional[int] = None):
+        """
+        Bring the text up to date with history, keeping at most limit tokens (None keeps every
+        turn). count_tokens(turn) returns the tokens of a turn's block. Returns the index of the
+        first turn in the text.
+        """
+        grown = self.start > 0 and (limit is None or (self.limit is not None and limit > self.limit))
+        if grown or self.end > len(history) or (self.end and history[self.end - 1] is not self.last):
+            self.rebuild(history, count_tokens, limit)
+            return self.start
+        for turn in history[self.end:]:
+            block = turn.block()
+            if block:
+                self.text += block
+                self.tokens += count_tokens(turn)
+        self.end = len(history)
+        self.last = history[-1] if history else None
+        self.limit = limit
+        while limit is not None and self.tokens > limit and self.start < self.end:
+            dropped = history[self.start]
+            block = dropped.block()
+            if block:
+                self.text = self.text[len(block):]
+                self.tokens -= count_tokens(dropped)
+            self.start += 1
+        return self.start
+
+    def rebuild(self, history, count_tokens, limit: Optional[int] = None):
+        start, tokens = len(history), 0
+        while start > 0 and (limit is None or tokens + count_tokens(history[start - 1]) <= limit):
+            start -= 1
+            tokens += count_tokens(history[start])
+        self.start = start
+        self.end = len(history)
+        self.last = history[-1] if history else None
+        self.text = "".join(block for block in (turn.block() for turn in history[start:]) if block)
+        self.tokens = tokens
+        self.limit = limit
@@ -0,0 +1,111 @@
+import re
+
+# Phrases after which the model is answering for the candidate; the rest of the line is dropped
+CUT_PHRASES = ("User:", "Candidate:", "I would", "Let me", "First,", "To answer", "Regarding", "As a")
+# Phrases that start a made-up turn of the other speaker, generation stops there
+TURN_PHRASES = ("User:", "Candidate:")
+CUT_PATTERN = re.compile("|".join(re.escape(phrase) for phrase in CUT_PHRASES), re.IGNORECASE)
+TURN_PATTERN = re.compile("|".join(re.escape(phrase) for phrase in TURN_PHRASES), re.IGNORECASE)
+# Longest text at the end of a line that could still grow into one of the phrases
+HOLD_BACK = max(len(phrase) for phrase in CUT_PHRASES) - 1
+# Every start of a phrase, lowercase
+PHRASE_PREFIXES = {phrase.lower()[:length] for phrase in CUT_PHRASES for length in range(1, len(phrase) + 1)}
+
+class ResponseFilter:
+    """
+    Cleans an interview answer while it is generated.
+
+    Text is fed in as it arrives and processed one line at a time: from the first phrase in which
+    the model starts answering for the candidate the rest of the line is dropped, empty lines are
+    skipped and surrounding whitespace is trimmed. Once the model starts a "User:" or "Candidate:"
+    turn, stopped is set so the caller can end the generation. feed returns the part of the text
+    that is final and can be streamed.
+
+    Every call only searches the text added to the line since the last one, plus HOLD_BACK
+    characters a phrase could have started in, so a line costs time linear in its length.
+    """
+
+    def __init__(self):
+        self.text = ""              # Filtered output so far
+        self.raw_line = ""          # Current line as generated, not yet complete
+        self.line = ""              # Current line up to the first cut phrase
+        self.line_emitted = 0       # Characters of the current line already in text
+        self.line_cut = False       # The rest of the current line is dropped
+        self.line_started = False   # The current line has visible content
+        self.line_break = ""        # Whitespace between the last line with content and the next one
+        self.cut_scanned = 0        # Characters of the current line searched for a cut phrase
+        self.turn_scanned = 0       # Characters of the current line searched for a turn phrase
+        self.stopped = False
+
+    def feed(self, text: str) -> str:
+        """Process the next piece of generated text and return the newly final output."""
+        start = len(self.text)
+        parts = text.split("\n")
+        for index, part in enumerate(parts):
+            if self.stopped:
+                break
+            self.raw_line += part
+            self.scan_line(complete=False)
+            if index < len(parts) - 1:
+                self.end_line()
+        return self.text[start:]
+
+    def finish(self) -> str:
+        """End of the generation, return the rest of the output."""
+        start = len(self.text)
+        if not self.stopped:
+            self.scan_line(complete=True)
+        self.raw_line = self.line = ""
+        self.cut_scanned = self.turn_scanned = 0
+        return self.text[start:]
+
+    def scan_line(self, complete: bool):
+        if TURN_PATTERN.search(self.raw_line, max(0, self.turn_scanned - HOLD_BACK)):
+            self.stopped = True
+        self.turn_scanned = len(self.raw_line)
+        if self.line_cut:
+            return
+        self.line = self.raw_line
+        match = CUT_PATTERN.search(self.line, max(0, self.cut_scanned - HOLD_BACK))
+        self.cut_scanned = len(self.line)
+        if match:
+            self.line = self.line[:match.start()]
+            self.line_cut = True
+            end = len(self.line)
+        elif complete:
+            end = len(self.line)
+        else:
+            end = len(self.line) - self.partial_phrase_length()
+        if end <= self.line_emitted:
+            return
+        # Trailing whitespace is only written once the line continues. Until the line has content
+        # nothing of it is emitted, so a line that is only whitespace so far stops here as well.
+        end = self.line_emitted + len(self.line[self.line_emitted:end].rstrip())
+        if end <= self.line_emitted:
+            return
+        if not self.line_started:
+            if self.text:
+                self.text += self.line_break
+            else:
+                # Leading whitespace of the answer is trimmed
+                self.line_emitted = len(self.line) - len(self.line.lstrip())
+            self.line_started = True
+        self.text += self.line[self.line_emitted:end]
+        self.line_emitted = end
+
+    def partial_phrase_length(self) -> int:
+        tail = self.line[-HOLD_BACK:].lower()
+        for length in range(len(tail), 0, -1):
+            if tail[-length:] in PHRASE_PREFIXES:
+                return length
+        return 0
+
+    def end_line(self):
+        self.scan_line(complete=True)
+        if self.line_started:
+            self.line_break = self.line[self.line_emitted:] + "\n"
+        self.raw_line = self.line = ""
+        self.cut_scanned = self.turn_scanned = 0
+        self.line_emitted = 0
+        self.line_cut = False
+        self.line_started = False
@@ -0,0 +1,113 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+import json
+
+from llama_cpp import LlamaGrammar
+
+NO_SUMMARY = "```No summary generated.\n```"
+
+# Turn markers the model writes when it starts inventing the next turn
+TURN_STOP = ("<|eot_id|>", "<|start_header_id|>", "\nUser:", "\nCandidate:")
+
+INTERVIEW_SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "feedback": {"type": "string"},
+        "strengths": {"type": "array", "items": {"type": "string"}, "maxItems": 5},
+        "improvements": {"type": "array", "items": {"type": "string"}, "maxItems": 5},
+        "overall": {"type": "string"},
+    },
+    "required": ["feedback", "strengths", "improvements", "overall"],
+}
+
+QUESTION_BANK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question": {"type": "string"},
+                    # How well the question tests what the job asks for, 5 is best
+                    "relevance": {"enum": [1, 2, 3, 4, 5]},
+                },
+                "required": ["question", "relevance"],
+            },
+            "maxItems": 12,
+        },
+    },
+    "required": ["questions"],
+}
+
+INTERVIEW_SUMMARY_INSTRUCTION = (
+    "This was the last question of the interview. Reply with JSON only: \"feedback\" is your brief feedback on "
+    "the last answer, at most 2 sentences; \"strengths\" and \"improvements\" list up to 5 short points each about "
+    "the candidate's answers in the whole interview; \"overall\" is one or two sentences assessing the interview."
+)
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """How the model generates in one kind of turn: where it stops and, optionally, the shape of the output."""
+    name: str
+    mode: str                   # Mode the turn belongs to, used to label metrics
+    priority: str               # Scheduler class, see inference.scheduler.PRIORITY_CLASSES
+    stop: tuple = field(default=TURN_STOP)
+    json_schema: Optional[dict] = None
+    gbnf: Optional[str] = None
+    instruction: Optional[str] = None  # Told to the model right before it answers, e.g. what the JSON fields hold
+
+    @property
+    def structured(self) -> bool:
+        return self.json_schema is not None or self.gbnf is not None
+
+    @property
+    def grammar(self) -> Optional[LlamaGrammar]:
+        return compile_grammar(self.name) if self.structured else None
+
+PROFILES = {
+    profile.name: profile for profile in (
+        GenerationProfile("chat", "chat", "chat"),
+        GenerationProfile("interview", "interview", "interview"),
+        GenerationProfile("quiz", "quiz", "practice"),
+        GenerationProfile("training", "training", "practice"),
+        # Last turn of an interview: feedback on the final answer plus the summary, as JSON
+        GenerationProfile("interview_summary", "interview", "interview", stop=(), json_schema=INTERVIEW_SUMMARY_SCHEMA,
+                          instruction=INTERVIEW_SUMMARY_INSTRUCTION),
+        GenerationProfile("history_summary", "summary", "background"),
+        # Question bank of a job description, generated in the background when the description is stored
+        GenerationProfile("question_bank", "interview", "background", stop=(), json_schema=QUESTION_BANK_SCHEMA),
+    )
+}
+
+def get_profile(name) -> GenerationProfile:
+    """Profile by name, modes without a profile of their own generate like the plain chat."""
+    return PROFILES.get(name or "chat", PROFILES["chat"])
+
+@lru_cache(maxsize=None)
+def compile_grammar(name: str) -> LlamaGrammar:
+    profile = PROFILES[name]
+    if profile.gbnf is not None:
+        return LlamaGrammar.from_string(profile.gbnf, verbose=False)
+    return LlamaGrammar.from_json_schema(json.dumps(profile.json_schema), verbose=False)
+
+def parse_interview_summary(text: str) -> Optional[dict]:
+    """The JSON written under the interview_summary profile, None if the output was cut off before it was complete."""
+    try:
+        summary = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(summary, dict):
+        return None
+    return summary
+
+def format_interview_summary(summary: dict) -> str:
+    """Render the parsed summary as the fenced bullet list that is shown to the candidate and stored."""
+    lines = [f"- Strength: {point}" for point in summary.get("strengths", [])]
+    lines += [f"- To improve: {point}" for point in summary.get("improvements", [])]
+    if summary.get("overall"):
+        lines.append(f"- Overall: {summary['overall']}")
+    if not lines:
+        return NO_SUMMARY
+    return "```\n" + "\n".join(lines) + "\n```"
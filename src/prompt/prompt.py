@@ -8,26 +8,39 @@ file_path = BASE_DIR / 'system_prompt.txt'
 with file_path.open('r', encoding='utf-8') as file:
     SYSTEM_PROMPT = file.read()
 
+# Llama 3 chat template blocks
+LLAMA3_SYSTEM = "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n{}\n<|eot_id|>"
+LLAMA3_USER = "<|start_header_id|>user<|end_header_id|>\n{}\n<|eot_id|>"
+LLAMA3_ASSISTANT = "<|start_header_id|>assistant<|end_header_id|>\n{}\n<|eot_id|>"
+LLAMA3_ASSISTANT_HEADER = "<|start_header_id|>assistant<|end_header_id|>\n"
+# Instruction for the next answer only, after the history
+LLAMA3_INSTRUCTION = "<|start_header_id|>system<|end_header_id|>\n{}\n<|eot_id|>"
+
+MODES = ("interview", "quiz", "training")
+
+# Read mode prompts once instead of on every request
+MODE_PROMPTS = {}
+for mode in MODES:
+    with (BASE_DIR / f'{mode}_prompt.txt').open('r', encoding='utf-8') as file:
+        MODE_PROMPTS[mode] = file.read()
+
 global CURRENT_MODE
 
-def get_system_prompt(user_input: str):
-    global CURRENT_MODE
-    system_prompt: str = SYSTEM_PROMPT
+def detect_mode(user_input: str):
+    """Return the mode selected by a slash command in the input, or None."""
     formatted_input = user_input.lower()
+    for mode in MODES:
+        if f"/{mode}" in formatted_input:
+            return mode
+    return None
+
+def get_mode_system_prompt(mode):
+    """System prompt for a mode. The same mode always yields the same text, so its tokens can be reused."""
+    if mode is None:
+        return SYSTEM_PROMPT
+    return SYSTEM_PROMPT + MODE_PROMPTS[mode]
 
-    if("/interview" in formatted_input):
-        CURRENT_MODE = "interview"
-    elif("/quiz" in formatted_input):
-        CURRENT_MODE = "quiz"
-    elif("/training" in formatted_input):
-        CURRENT_MODE = "training"
-    else:
-        CURRENT_MODE = None
-
-    if CURRENT_MODE is not None:
-        file = open("prompt/" + CURRENT_MODE + '_prompt.txt', 'r')
-        mode_prompt = file.read()
-        file.close()
-        system_prompt += mode_prompt
-    
-    return system_prompt
\ No newline at end of file
+def get_system_prompt(user_input: str):
+    global CURRENT_MODE
+    CURRENT_MODE = detect_mode(user_input)
+    return get_mode_system_prompt(CURRENT_MODE)
@@ -0,0 +1,76 @@
+import json
+import random
+
+from prompt.history import PromptBuffer, Turn, USER, ASSISTANT, JOB_DESCRIPTION, encode_turn, decode_turn
+
+def count_tokens(turn: Turn) -> int:
+    block = turn.block()
+    return len(block.split()) if block else 0
+
+def expected(history, limit):
+    """Blocks of the most recent turns that fit into limit, built from scratch."""
+    start, tokens = len(history), 0
+    while start > 0 and (limit is None or tokens + count_tokens(history[start - 1]) <= limit):
+        start -= 1
+        tokens += count_tokens(history[start])
+    return start, "".join(turn.block() or "" for turn in history[start:]), tokens
+
+def check(buffer, history, limit):
+    start = buffer.update(history, count_tokens, limit)
+    assert (start, buffer.text, buffer.tokens) == expected(history, limit)
+
+def turn(index: int) -> Turn:
+    return Turn(USER if index % 2 == 0 else ASSISTANT, " ".join(["word"] * (index % 5 + 1)))
+
+def test_appends_new_turns():
+    history, buffer = [Turn(JOB_DESCRIPTION, "Python developer")], PromptBuffer()
+    for index in range(6):
+        history.append(turn(index))
+        check(buffer, history, None)
+    assert buffer.start == 0 and buffer.end == 7
+
+def test_drops_oldest_turns_over_the_limit():
+    history, buffer = [], PromptBuffer()
+    for index in range(30):
+        history.append(turn(index))
+        check(buffer, history, 40)
+    assert buffer.start > 0
+
+def test_rebuilds_after_history_rewrite():
+    history, buffer = [turn(index) for index in range(10)], PromptBuffer()
+    check(buffer, history, 50)
+    # Summarized: the oldest turns are gone
+    del history[:4]
+    check(buffer, history, 50)
+    # A cancelled turn taken back and another one sent
+    history.pop()
+    history.append(Turn(USER, "something else"))
+    check(buffer, history, 50)
+
+def test_grown_limit_brings_older_turns_back():
+    history, buffer = [turn(index) for index in range(20)], PromptBuffer()
+    check(buffer, history, 30)
+    check(buffer, history, 80)
+    check(buffer, history, None)
+    assert buffer.start == 0
+
+def test_random_histories_match_a_fresh_build():
+    rng = random.Random(3)
+    for _ in range(200):
+        history, buffer = [], PromptBuffer()
+        for step in range(rng.randint(1, 30)):
+            action = rng.random()
+            if action < 0.7 or not history:
+                history.append(turn(rng.randint(0, 9)))
+            elif action < 0.85:
+                del history[:rng.randint(1, len(history))]
+            else:
+                history.pop()
+            check(buffer, history, rng.choice([None, 10, 25, 60]))
+
+def test_turns_survive_json():
+    history = [Turn(JOB_DESCRIPTION, "Data engineer"), Turn(USER, "Hi", tokens=3), Turn(ASSISTANT, "Hello")]
+    restored = json.loads(json.dumps({"history": history}, default=encode_turn), object_hook=decode_turn)["history"]
+    assert restored == history
+    assert restored[1].tokens == 3
+    assert str(restored[0]) == "User provided Job Description: Data engineer"
@@ -0,0 +1,65 @@
+import random
+import re
+
+from prompt.output_filter import ResponseFilter, TURN_PATTERN
+
+# The regex passes ResponseFilter replaced, run once over the whole answer
+USER_RESPONSE_PATTERNS = [
+    r"User:.*?(?=\n|$)", r"Candidate:.*?(?=\n|$)", r"I would.*?(?=\n|$)",
+    r"Let me.*?(?=\n|$)", r"First,.*?(?=\n|$)", r"To answer.*?(?=\n|$)",
+    r"Regarding.*?(?=\n|$)", r"As a.*?(?=\n|$)",
+]
+PIECES = ["Good", " answer", ".", " ", "  ", "\n", "\n\n", "as a", "As A", "has a", "let", " me", "User", ":", "Candidate:",
+          "First,", "- point", "```", "code", " \t", "Regarding", "I would", "-", "x"]
+
+def validate_interview_response(response: str) -> str:
+    for pattern in USER_RESPONSE_PATTERNS:
+        response = re.sub(pattern, "", response, flags=re.IGNORECASE)
+    response = "\n".join(line for line in response.split("\n") if line.strip())
+    return response.strip()
+
+def run_filter(text: str, rng: random.Random):
+    """Feed text in random chunks, as tokens arrive, and return the streamed output and the filter."""
+    output_filter = ResponseFilter()
+    streamed = ""
+    position = 0
+    while position < len(text) and not output_filter.stopped:
+        size = rng.randint(1, 6)
+        streamed += output_filter.feed(text[position:position + size])
+        position += size
+    streamed += output_filter.finish()
+    return streamed, output_filter
+
+def test_matches_regex_passes_on_random_chunked_input():
+    rng = random.Random(1)
+    for _ in range(5000):
+        text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 25)))
+        streamed, output_filter = run_filter(text, rng)
+        # The filter stops at an invented turn, the old passes saw the text up to it
+        turn = TURN_PATTERN.search(text)
+        expected = validate_interview_response((text[:turn.start()] if turn else text).strip())
+        assert streamed == output_filter.text == expected, repr(text)
+
+def test_stops_at_invented_turn():
+    output_filter = ResponseFilter()
+    assert output_filter.feed("What is a closure?\nUs") == "What is a closure?"
+    assert not output_filter.stopped
+    output_filter.feed("er: It is")
+    assert output_filter.stopped
+    assert output_filter.finish() == ""
+    assert output_filter.text == "What is a closure?"
+
+def test_holds_back_partial_phrase():
+    output_filter = ResponseFilter()
+    assert output_filter.feed("Tell me more. Let") == "Tell me more."
+    # "r" could still become "Regarding"
+    assert output_filter.feed("ter by letter") == " Letter by lette"
+    assert output_filter.finish() == "r"
+
+def test_long_line_is_scanned_incrementally():
+    output_filter = ResponseFilter()
+    for index in range(5000):
+        output_filter.feed(f" word{index % 7}")
+    output_filter.finish()
+    assert output_filter.text.startswith("word0 word1")
+    assert output_filter.cut_scanned == 0  # reset once the line is finished
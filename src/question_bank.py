@@ -0,0 +1,117 @@
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import re
+import threading
+
+from database import question_bank as question_bank_db
+from prompt.prompt import LLAMA3_SYSTEM, LLAMA3_USER, LLAMA3_ASSISTANT_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Generated questions outside these lengths are cut off or not a real question
+MIN_QUESTION_LENGTH = 20
+MAX_QUESTION_LENGTH = 300
+WORD_PATTERN = re.compile(r"[a-z][a-z0-9+#.-]{3,}")
+
+def job_description_key(job_description: str) -> str:
+    """Key of a job description's question bank, equal for texts that only differ in case and whitespace."""
+    return hashlib.sha256(" ".join(job_description.lower().split()).encode("utf-8")).hexdigest()
+
+def build_question_bank_prompt(job_description: str, size: int) -> str:
+    return (
+        LLAMA3_SYSTEM.format(
+            "You are an experienced technical recruiter preparing a job interview. Write interview questions "
+            "for the job description below. Every question stands on its own, asks about one topic and can be "
+            "answered in a few minutes. Rate the relevance of each question for the job from 1 to 5. "
+            "Reply with JSON only."
+        )
+        + LLAMA3_USER.format(f"Job Description: {job_description}\n\nWrite {size} interview questions.")
+        + LLAMA3_ASSISTANT_HEADER
+    )
+
+def parse_question_bank(text: str):
+    """Questions and ratings written under the question_bank profile, None if the output is not complete JSON."""
+    try:
+        bank = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(bank, dict) or not isinstance(bank.get("questions"), list):
+        return None
+    return [item for item in bank["questions"] if isinstance(item, dict) and isinstance(item.get("question"), str)]
+
+def rank_questions(candidates, job_description: str, size: int):
+    """
+    Clean, deduplicate and order generated questions: by the model's relevance rating, then by how
+    many words of the job description they mention, then in the order they were written.
+    """
+    job_words = set(WORD_PATTERN.findall(job_description.lower()))
+    ranked, seen = [], set()
+    for index, candidate in enumerate(candidates):
+        question = " ".join(candidate["question"].split())
+        normalized = question.lower().rstrip("?.")
+        if not MIN_QUESTION_LENGTH <= len(question) <= MAX_QUESTION_LENGTH or normalized in seen:
+            continue
+        seen.add(normalized)
+        if question[-1] not in "?.":
+            question += "?"
+        overlap = len(job_words & set(WORD_PATTERN.findall(question.lower())))
+        ranked.append((-int(candidate.get("relevance", 1)), -overlap, index, question))
+    return [question for *_, question in sorted(ranked)[:size]]
+
+class QuestionBankStore:
+    """
+    Ranked interview questions per job description, in memory and in MariaDB.
+
+    Banks are kept in an LRU of max_entries job descriptions and loaded from the database on a
+    miss, so they survive restarts and are shared by every session with the same description.
+    claim marks a bank as being generated, so every job description is generated only once.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._banks = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Questions of the bank, best first, or None if there is no bank (yet)."""
+        with self._lock:
+            questions = self._banks.get(key)
+            if questions is not None:
+                self._banks.move_to_end(key)
+                return questions
+            if key in self._pending:
+                return None
+        questions = question_bank_db.get_question_bank(key)
+        if not questions:
+            return None
+        self._remember(key, questions)
+        return questions
+
+    def claim(self, key: str) -> bool:
+        """Mark the bank as being generated. False if it exists or another generation already runs."""
+        if self.get(key) is not None:
+            return False
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            return True
+
+    def release(self, key: str):
+        with self._lock:
+            self._pending.discard(key)
+
+    def put(self, key: str, questions):
+        self._remember(key, questions)
+        question_bank_db.save_question_bank(key, questions)
+        self.release(key)
+
+    def _remember(self, key: str, questions):
+        with self._lock:
+            self._banks[key] = questions
+            self._banks.move_to_end(key)
+            while len(self._banks) > self.max_entries:
+                self._banks.popitem(last=False)
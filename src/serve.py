@@ -0,0 +1,44 @@
+"""
+Run the API with several uvicorn worker processes that share one copy of the model weights.
+
+Every worker memory-maps the same GGUF file read-only, so the weights live once in the page cache
+and only the KV caches and Python heap are private to a worker. Run from the src folder:
+
+    python serve.py --workers 4
+"""
+import argparse
+import logging
+import os
+
+import uvicorn
+
+import setup_llama
+
+logger = logging.getLogger(__name__)
+
+def preload_model_file(path: str):
+    """Read the model into the page cache once, so the workers map already resident pages instead of each reading the file."""
+    with open(path, "rb") as file:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while file.read(64 * 1024 * 1024):
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 2)))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    settings = setup_llama.llama_settings
+    if not settings.LLAMA_USE_MMAP:
+        logger.warning("LLAMA_USE_MMAP is off, every worker will hold a private copy of the model weights")
+    if settings.LLAMA_USE_MLOCK:
+        logger.warning("LLAMA_USE_MLOCK is on, every worker locks the shared weights and counts them against its memlock limit")
+    preload_model_file(settings.LLAMA_MODEL_PATH)
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+
+from prompt.history import encode_turn, decode_turn
+from inference.metrics import SESSIONS, SESSION_BYTES, SESSION_SIZE, SESSION_EVICTIONS, SESSION_LOAD
+
+logger = logging.getLogger(__name__)
+
+# Per-process bookkeeping in a session, not written to a shared store
+TRANSIENT_KEYS = ("version", "prompt_buffer")
+# Shared stores drop sessions idle past the TTL at most this often
+EXPIRE_INTERVAL_SECONDS = 60
+
+def estimate_size(value) -> int:
+    """Approximate memory held by a session: the object and everything it references, strings and containers included."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(item) for item in value)
+    elif hasattr(value, "__slots__"):
+        size += sum(estimate_size(getattr(value, name)) for name in value.__slots__ if hasattr(value, name))
+    return size
+
+class VersionConflict(Exception):
+    """Raised when a turn is committed to a session that another request committed since the turn read it."""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Session {session_id} was changed by another request")
+        self.session_id = session_id
+
+class SessionLoadError(Exception):
+    """Raised when a session that is not in the store cannot be loaded, e.g. while the database is down."""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Session {session_id} could not be loaded")
+        self.session_id = session_id
+
+class SessionBackend(ABC):
+    """
+    Where chat sessions live between turns.
+
+    get returns the session a turn works on and commit writes everything the turn changed in one
+    step. A session that is not in the store is read back by load(session_id), for example from
+    the chat history in the database; load returns None for a session that was never stored,
+    which then starts from factory. If load fails, SessionLoadError is raised and nothing is
+    stored, so the next request tries again. Concurrent requests for a missing session wait for
+    one load.
+    """
+
+    def __init__(self, factory, load=None):
+        self.factory = factory
+        self.load = load
+        self._loading = {}  # session id -> Future of the load in progress
+        self._loading_lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, session_id: str):
+        """The session, loaded or created if it is not in the store."""
+
+    @abstractmethod
+    def commit(self, session_id: str, session):
+        """Write the changes of a turn. Raises VersionConflict if another request committed the session in between."""
+
+    @abstractmethod
+    def put(self, session_id: str, session):
+        """Store a session, replacing whatever is stored for session_id."""
+
+    def update(self, session_id: str, change) -> bool:
+        """
+        Apply change(session) to the latest state of the session and commit it, starting over on
+        the then latest state whenever another request committed in between. change returns False
+        to leave the session as it is. Returns whether the session was committed.
+        """
+        while True:
+            session = self.get(session_id)
+            if change(session) is False:
+                return False
+            try:
+                self.commit(session_id, session)
+                return True
+            except VersionConflict:
+                logger.debug(f"Session {session_id} changed while updating it, trying again")
+
+    @abstractmethod
+    def pop(self, session_id: str):
+        """Remove a session and return it, None if it is not stored."""
+
+    def stats(self) -> dict:
+        return {}
+
+    def __getitem__(self, session_id: str):
+        return self.get(session_id)
+
+    def __setitem__(self, session_id: str, session):
+        self.put(session_id, session)
+
+    def _load_once(self, session_id: str, store):
+        """
+        Load or create a missing session, once for all concurrent requests. store(session) keeps it
+        and returns the session to use, which is another request's if that one stored it first.
+        """
+        with self._loading_lock:
+            loading = self._loading.get(session_id)
+            owner = loading is None
+            if owner:
+                loading = self._loading[session_id] = Future()
+        if not owner:
+            return loading.result()
+        try:
+            session = store(self._load(session_id))
+            loading.set_result(session)
+            return session
+        except BaseException as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            with self._loading_lock:
+                del self._loading[session_id]
+
+    def _load(self, session_id: str):
+        if self.load is None:
+            return self.factory()
+        started = time.perf_counter()
+        try:
+            session = self.load(session_id)
+        except Exception as e:
+            SESSION_LOAD.labels("failed").observe(time.perf_counter() - started)
+            logger.error(f"Error loading session {session_id}: {str(e)}")
+            raise SessionLoadError(session_id) from e
+        SESSION_LOAD.labels("new" if session is None else "loaded").observe(time.perf_counter() - started)
+        if session is None:
+            return self.factory()
+        logger.info(f"Loaded session {session_id} in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return session
+
+class SessionStore(SessionBackend):
+    """
+    Chat sessions in the memory of this process, bounded in number, estimated memory and idle time.
+
+    Sessions are kept in least recently used order. Once there are more than max_sessions or
+    their estimated size passes max_bytes, the least recently used ones are evicted; sessions
+    idle for longer than idle_ttl_seconds are dropped as well. Turns change the sessions in
+    place, commit only re-estimates their size. Sessions are not shared between processes.
+    clock returns the time in seconds idle time is measured with.
+    """
+
+    def __init__(self, factory, max_sessions: int, max_bytes: int, idle_ttl_seconds: float, load=None, on_evict=None,
+                 clock=time.monotonic):
+        super().__init__(factory, load)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.on_evict = on_evict
+        self.clock = clock
+        self.size_bytes = 0
+        self._sessions = OrderedDict()  # session id -> (session, estimated size, last use)
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str):
+        """The session, loaded or created if it is not in memory."""
+        with self._lock:
+            self._expire()
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions[session_id] = (entry[0], entry[1], self.clock())
+                self._sessions.move_to_end(session_id)
+                return entry[0]
+        return self._load_once(session_id, lambda session: self._insert(session_id, session, replace=False))
+
+    def commit(self, session_id: str, session):
+        """Re-estimate the size of a session after it changed, and evict what no longer fits."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] is not session:
+                return
+            size = estimate_size(session)
+            self.size_bytes += size - entry[1]
+            self._sessions[session_id] = (session, size, self.clock())
+            self._sessions.move_to_end(session_id)
+            SESSION_SIZE.observe(size)
+            self._shrink()
+            self._report()
+
+    def put(self, session_id: str, session):
+        self._insert(session_id, session)
+
+    def pop(self, session_id: str):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self.size_bytes -= entry[1]
+                self._report()
+            return entry[0] if entry is not None else None
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self.size_bytes, "loading": len(self._loading)}
+
+    def _insert(self, session_id: str, session, replace: bool = True):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                if not replace:
+                    # Created by a request that got here first
+                    self._sessions[session_id] = entry
+                    return entry[0]
+                self.size_bytes -= entry[1]
+            size = estimate_size(session)
+            self._sessions[session_id] = (session, size, self.clock())
+            self.size_bytes += size
+            self._shrink()
+            self._report()
+            return session
+
+    def _shrink(self):
+        # The most recently used session stays even if it alone is over the budget
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self.size_bytes > self.max_bytes):
+            self._evict("count" if len(self._sessions) > self.max_sessions else "memory")
+
+    def _expire(self):
+        if self.idle_ttl_seconds <= 0:
+            return
+        cutoff = self.clock() - self.idle_ttl_seconds
+        expired = False
+        # Sessions are ordered by last use, so the idle ones are at the front
+        while self._sessions and next(iter(self._sessions.values()))[2] < cutoff:
+            self._evict("idle")
+            expired = True
+        if expired:
+            self._report()
+
+    def _evict(self, reason: str):
+        session_id, (_, size, _) = self._sessions.popitem(last=False)
+        self.size_bytes -= size
+        SESSION_EVICTIONS.labels(reason).inc()
+        logger.debug(f"Evicted session {session_id} ({reason})")
+        if self.on_evict is not None:
+            self.on_evict(session_id)
+
+    def _report(self):
+        SESSIONS.set(len(self._sessions))
+        SESSION_BYTES.set(self.size_bytes)
+
+class SqlSessionStore(SessionBackend):
+    """
+    Chat sessions in the SessionState table, shared by every process that uses the same database.
+
+    Every row holds the session as JSON and a version. get reads the current row, so a turn sees
+    what other workers committed, and commit writes the whole session in one UPDATE that only
+    succeeds if the version is still the one the turn read (optimistic locking). Otherwise the
+    turn raced with another request for the session and VersionConflict is raised. Sessions
+    idle for longer than idle_ttl_seconds are deleted. Subclasses run the statements.
+    """
+
+    integrity_error = Exception
+
+    def __init__(self, factory, idle_ttl_seconds: float, load=None):
+        super().__init__(factory, load)
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._expired_at = time.monotonic()
+
+    def get(self, session_id: str):
+        session = self._read(session_id)
+        if session is None:
+            self._load_once(session_id, lambda loaded: self._insert(session_id, loaded))
+            # Every request works on its own copy
+            session = self._read(session_id)
+        return session
+
+    def commit(self, session_id: str, session):
+        version = session["version"]
+        updated, _ = self._execute(
+            "UPDATE SessionState SET version = ?, data = ?, updated_at = ? WHERE session_id = ? AND version = ?",
+            (version + 1, self._dump(session), time.time(), session_id, version)
+        )
+        if not updated:
+            raise VersionConflict(session_id)
+        session["version"] = version + 1
+        self._expire()
+
+    def put(self, session_id: str, session):
+        self._execute("DELETE FROM SessionState WHERE session_id = ?", (session_id,))
+        self._insert(session_id, session)
+
+    def pop(self, session_id: str):
+        session = self._read(session_id)
+        self._execute("DELETE FROM SessionState WHERE session_id = ?", (session_id,))
+        return session
+
+    def __contains__(self, session_id: str) -> bool:
+        _, rows = self._execute("SELECT 1 FROM SessionState WHERE session_id = ?", (session_id,))
+        return bool(rows)
+
+    def stats(self) -> dict:
+        _, rows = self._execute("SELECT COUNT(*) FROM SessionState")
+        return {"sessions": rows[0][0], "loading": len(self._loading)}
+
+    def _read(self, session_id: str):
+        _, rows = self._execute("SELECT version, data FROM SessionState WHERE session_id = ?", (session_id,))
+        if not rows:
+            return None
+        version, data = rows[0]
+        session = json.loads(data, object_hook=decode_turn)
+        session["version"] = version
+        return session
+
+    def _insert(self, session_id: str, session):
+        try:
+            self._execute(
+                "INSERT INTO SessionState (session_id, version, data, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, 1, self._dump(session), time.time())
+            )
+        except self.integrity_error:
+            # Another worker stored the session first, theirs is the one to use
+            pass
+        return session
+
+    def _expire(self):
+        if self.idle_ttl_seconds <= 0 or time.monotonic() - self._expired_at < EXPIRE_INTERVAL_SECONDS:
+            return
+        self._expired_at = time.monotonic()
+        expired, _ = self._execute("DELETE FROM SessionState WHERE updated_at < ?", (time.time() - self.idle_ttl_seconds,))
+        if expired > 0:
+            SESSION_EVICTIONS.labels("idle").inc(expired)
+
+    def _dump(self, session) -> str:
+        return json.dumps({key: value for key, value in session.items() if key not in TRANSIENT_KEYS}, default=encode_turn)
+
+    @abstractmethod
+    def _execute(self, query: str, params=()):
+        """Run one statement in its own transaction and return the number of changed rows and the result rows."""
+
+class SqliteSessionStore(SqlSessionStore):
+    """
+    SessionState in an SQLite file, shared by the worker processes of one machine. With the
+    path ":memory:" the sessions only live in this process, a stand-in for tests and benchmarks.
+    """
+
+    integrity_error = sqlite3.IntegrityError
+
+    def __init__(self, path: str, factory, idle_ttl_seconds: float, load=None):
+        super().__init__(factory, idle_ttl_seconds, load)
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        if path != ":memory:":
+            # Readers do not block the writer of another worker
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        from database.setup_maria_db import SESSION_STATE_TABLE
+        self._connection.execute(SESSION_STATE_TABLE)
+        self._lock = threading.Lock()
+
+    def _execute(self, query: str, params=()):
+        with self._lock, self._connection:
+            cursor = self._connection.execute(query, params)
+            return cursor.rowcount, cursor.fetchall()
+
+class MariaDBSessionStore(SqlSessionStore):
+    """SessionState in the app's MariaDB database, shared by every worker on every node."""
+
+    def __init__(self, factory, idle_ttl_seconds: float, load=None):
+        super().__init__(factory, idle_ttl_seconds, load)
+        import mariadb
+        self.integrity_error = mariadb.IntegrityError
+        self._table_ready = False
+
+    def _execute(self, query: str, params=()):
+        from database import setup_maria_db
+        from database.setup_maria_db import db_settings, SESSION_STATE_TABLE
+        connection = setup_maria_db.get_db_connection(db_settings.DB_NAME)
+        try:
+            cursor = connection.cursor()
+            if not self._table_ready:
+                cursor.execute(SESSION_STATE_TABLE)
+                self._table_ready = True
+            cursor.execute(query, params)
+            rows = cursor.fetchall() if cursor.description else []
+            connection.commit()
+            return cursor.rowcount, rows
+        finally:
+            connection.close()
@@ -1,11 +1,113 @@
 from llama_cpp import Llama
+from llama_cpp._internals import LlamaModel, LlamaContext
+import llama_cpp
+from inference.speculative import setup_draft_model
+from typing import Optional
+from pydantic_settings import BaseSettings
+from pydantic import Field
+import os
 
-def setup_model(core_count, batch_size, context_size):
+class LlamaSettings(BaseSettings):
+    LLAMA_MODEL_PATH: str = Field(default="Meta-Llama-3.1-8B-Instruct-Q3_K_L.gguf", description="Path of the GGUF model file")
+    LLAMA_WORKERS: int = Field(default=1, description="Number of model workers, each with its own context")
+    LLAMA_N_THREADS: int = Field(default=2, description="CPU threads used by each model worker for generation")
+    LLAMA_N_THREADS_BATCH: Optional[int] = Field(default=None, description="CPU threads used for prompt evaluation, defaults to LLAMA_N_THREADS")
+    LLAMA_N_BATCH: int = Field(default=512, description="Logical batch size for prompt evaluation")
+    LLAMA_N_UBATCH: int = Field(default=512, description="Physical batch size, at most LLAMA_N_BATCH")
+    LLAMA_N_CTX: int = Field(default=2048, description="Context size of every model worker, prompts are budgeted against it")
+    LLAMA_USE_MMAP: bool = Field(default=True, description="Memory-map the model file instead of reading it into memory")
+    LLAMA_USE_MLOCK: bool = Field(default=False, description="Lock the model in RAM so it is never swapped out")
+    LLAMA_FLASH_ATTN: bool = Field(default=False, description="Use flash attention")
+    LLAMA_BATCHED_SEQUENCES: int = Field(default=0, description="Sequences decoded together in one context by the batched engine, 0 uses one context per worker")
+    LLAMA_QUEUE_SIZE: int = Field(default=32, description="Maximum number of requests waiting for a free worker")
+    LLAMA_SPECULATIVE: str = Field(default="none", description="Speculative decoding: 'none', 'prompt_lookup' or 'draft'")
+    LLAMA_DRAFT_TOKENS: int = Field(default=10, description="Tokens drafted per speculative step")
+    LLAMA_LOOKUP_NGRAM: int = Field(default=2, description="Longest n-gram matched against the prompt by prompt lookup decoding")
+    LLAMA_DRAFT_MODEL_PATH: Optional[str] = Field(default=None, description="Small GGUF with the same vocabulary, used by the 'draft' mode")
+    LLAMA_STATE_CACHE_BYTES: int = Field(default=1024 * 1024 * 1024, description="Memory budget for saved per-session llama states")
+    RESPONSE_CACHE_SIZE: int = Field(default=256, description="Number of model responses kept in the response cache, 0 disables it")
+    RESPONSE_CACHE_TTL_SECONDS: int = Field(default=3600, description="How long a cached model response stays valid")
+    RESPONSE_CACHE_MODES: str = Field(default="", description="Comma separated modes whose turns may be answered from the cache ('chat' for no mode), none by default")
+    HISTORY_SUMMARY_TRIGGER_TOKENS: int = Field(default=1024, description="History size in tokens at which older turns are summarized")
+    HISTORY_KEEP_ENTRIES: int = Field(default=4, description="Most recent history entries that are never summarized")
+    HISTORY_SUMMARY_MAX_TOKENS: int = Field(default=256, description="Maximum length of the running conversation summary")
+    INTERVIEW_SUMMARY_MAX_TOKENS: int = Field(default=1024, description="Maximum length of the last interview answer, the feedback and summary as JSON")
+    QUESTION_BANK_SIZE: int = Field(default=8, description="Interview questions kept per job description, 0 disables the question bank")
+    QUESTION_BANK_MAX_TOKENS: int = Field(default=1024, description="Maximum length of the generation that writes a question bank")
+    QUESTION_BANK_CACHE_SIZE: int = Field(default=256, description="Question banks of different job descriptions kept in memory")
+    SESSION_BACKEND: str = Field(default="memory", description="Where chat sessions are kept: 'memory' (this process), 'sqlite' (workers of one machine) or 'mariadb' (all nodes)")
+    SESSION_SQLITE_PATH: str = Field(default=os.path.join(os.path.dirname(__file__), "sessions.sqlite3"), description="Database file of the 'sqlite' session backend")
+    SESSION_MAX_COUNT: int = Field(default=1000, description="Chat sessions kept in memory, least recently used ones are evicted")
+    SESSION_MAX_BYTES: int = Field(default=256 * 1024 * 1024, description="Memory budget for the chat sessions kept in memory, estimated")
+    SESSION_IDLE_TTL_SECONDS: int = Field(default=4 * 3600, description="Chat sessions idle for longer are dropped from memory, 0 keeps them")
+    SESSION_LOAD_TURNS: int = Field(default=20, description="Most recent turns read back from the database when a session is not in memory")
+
+    class Config:
+        env_file = os.path.join(os.path.dirname(__file__), ".env")
+        env_file_encoding = "utf-8"
+        env_prefix = ""
+        extra = "ignore"  # This will ignore extra fields in the .env file
+
+llama_settings = LlamaSettings()
+
+def setup_model(core_count=None, batch_size=None, context_size=None, speculative=None,
+                threads_batch=None, ubatch_size=None):
+    """Load the model. Arguments that are not given are taken from the LLAMA_* settings."""
+    core_count = core_count or llama_settings.LLAMA_N_THREADS
+    batch_size = batch_size or llama_settings.LLAMA_N_BATCH
+    context_size = context_size or llama_settings.LLAMA_N_CTX
+    speculative = speculative or llama_settings.LLAMA_SPECULATIVE
+    threads_batch = threads_batch or llama_settings.LLAMA_N_THREADS_BATCH or core_count
+    ubatch_size = min(ubatch_size or llama_settings.LLAMA_N_UBATCH, batch_size)
     llm = Llama(
-        model_path="Meta-Llama-3.1-8B-Instruct-Q3_K_L.gguf",
-        n_threads=core_count,   # CPU Cores used
-        n_batch=batch_size,     # Batch size, should be a square of 2
-        n_ctx=context_size,     # Context size, should be a square of 2
-        verbose=False           # Suppress output
+        model_path=llama_settings.LLAMA_MODEL_PATH,
+        n_threads=core_count,           # CPU Cores used
+        n_threads_batch=threads_batch,  # CPU Cores used for prompt evaluation
+        n_batch=batch_size,             # Batch size, should be a square of 2
+        n_ubatch=ubatch_size,           # Physical batch size
+        n_ctx=context_size,             # Context size, should be a square of 2
+        use_mmap=llama_settings.LLAMA_USE_MMAP,
+        use_mlock=llama_settings.LLAMA_USE_MLOCK,
+        flash_attn=llama_settings.LLAMA_FLASH_ATTN,
+        draft_model=setup_draft_model(
+            speculative,
+            num_pred_tokens=llama_settings.LLAMA_DRAFT_TOKENS,
+            max_ngram_size=llama_settings.LLAMA_LOOKUP_NGRAM,
+            draft_model_path=llama_settings.LLAMA_DRAFT_MODEL_PATH,
+            n_threads=core_count,
+            n_ctx=context_size
+        ),
+        verbose=False                   # Suppress output
     )
     return llm
+
+def setup_tokenizer():
+    """Load only the vocabulary of the model, enough to count tokens without a context."""
+    return Llama(
+        model_path=llama_settings.LLAMA_MODEL_PATH,
+        vocab_only=True,
+        verbose=False
+    )
+
+def setup_batched_model(sequences=None):
+    """
+    Load the model with a single context that holds several sequences, for the batched engine.
+    Every sequence gets LLAMA_N_CTX tokens of the shared KV cache.
+    """
+    sequences = sequences or llama_settings.LLAMA_BATCHED_SEQUENCES
+    model_params = llama_cpp.llama_model_default_params()
+    model_params.use_mmap = llama_settings.LLAMA_USE_MMAP
+    model_params.use_mlock = llama_settings.LLAMA_USE_MLOCK
+    model = LlamaModel(path_model=llama_settings.LLAMA_MODEL_PATH, params=model_params, verbose=False)
+    # Every step carries one token per decoding sequence, so the batch must hold at least that many
+    batch_size = max(llama_settings.LLAMA_N_BATCH, sequences)
+    context_params = llama_cpp.llama_context_default_params()
+    context_params.n_ctx = llama_settings.LLAMA_N_CTX * sequences
+    context_params.n_seq_max = sequences
+    context_params.n_batch = batch_size
+    context_params.n_ubatch = min(max(llama_settings.LLAMA_N_UBATCH, sequences), batch_size)
+    context_params.n_threads = llama_settings.LLAMA_N_THREADS
+    context_params.n_threads_batch = llama_settings.LLAMA_N_THREADS_BATCH or llama_settings.LLAMA_N_THREADS
+    context_params.flash_attn = llama_settings.LLAMA_FLASH_ATTN
+    context = LlamaContext(model=model, params=context_params, verbose=False)
+    return model, context
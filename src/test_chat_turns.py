@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from chat_turns import ChatTurns
+from inference.cancellation import GenerationCancelled
+
+class Session:
+    """Stands in for run_chat_turn: records the turns it runs and saves, each waits until released."""
+
+    def __init__(self):
+        self.started = []
+        self.saved = []
+        self.cancels = {}
+        self.release = {}
+
+    def run(self, user_input: str):
+        async def run(on_token, cancel):
+            self.started.append(user_input)
+            self.cancels[user_input] = cancel
+            release = self.release.setdefault(user_input, asyncio.Event())
+            while not release.is_set():
+                cancel.check()
+                await asyncio.sleep(0)
+            self.saved.append(user_input)
+            return {"response": f"answer to {user_input}"}
+        return run
+
+    def finish(self, user_input: str):
+        self.release.setdefault(user_input, asyncio.Event()).set()
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def test_duplicate_request_attaches_and_the_turn_is_saved_once():
+    async def main():
+        turns, session = ChatTurns(), Session()
+        first = turns.join("a", "hello", "alice", session.run("hello"))
+        first.attach()
+        second = turns.join("a", "hello", "alice", session.run("hello"))
+        second.attach()
+        assert second is first and first.clients == 2
+        # The same input from another user is a turn of its own
+        other = turns.join("a", "hello", "bob", session.run("hello"))
+        other.attach()
+        assert other is not first
+        session.finish("hello")
+        assert await asyncio.shield(first.task) == {"response": "answer to hello"}
+        await other.task
+        assert session.saved == ["hello", "hello"]  # once for alice, once for bob
+        assert turns.join("a", "hello", "alice", session.run("hello")) is not first
+
+    asyncio.run(main())
+
+def test_turns_of_a_session_run_in_arrival_order():
+    async def main():
+        turns, session = ChatTurns(), Session()
+        inputs = ("first", "second", "third")
+        for user_input in inputs:
+            turns.join("a", user_input, "alice", session.run(user_input)).attach()
+        other = turns.join("b", "other", "alice", session.run("other"))
+        other.attach()
+        await settle()
+        # Only the oldest turn of a session runs, the other session does not wait for it
+        assert session.started == ["first", "other"]
+        for user_input in reversed(inputs):
+            session.finish(user_input)
+        session.finish("other")
+        await settle()
+        assert [saved for saved in session.saved if saved != "other"] == list(inputs)
+        assert not turns._sessions and not turns._turns
+
+    asyncio.run(main())
+
+def test_turn_is_cancelled_only_when_every_client_left():
+    async def main():
+        turns, session = ChatTurns(), Session()
+        turn = turns.join("a", "hello", "alice", session.run("hello"))
+        leave_first = turn.attach()
+        leave_second = turns.join("a", "hello", "alice", session.run("hello")).attach()
+        await settle()
+        leave_first()
+        leave_first()  # leaving twice counts once
+        await settle()
+        assert turn.clients == 1 and turn.cancel.reason is None and not turn.task.done()
+        leave_second()
+        assert turn.cancel.reason == "disconnected"
+        with pytest.raises(GenerationCancelled):
+            await turn.task
+        assert session.saved == []
+
+    asyncio.run(main())
+
+def test_turn_whose_clients_left_while_waiting_does_not_run():
+    async def main():
+        turns, session = ChatTurns(), Session()
+        turns.join("a", "first", "alice", session.run("first")).attach()
+        waiting = turns.join("a", "second", "alice", session.run("second"))
+        waiting.attach()()
+        session.finish("first")
+        with pytest.raises(GenerationCancelled):
+            await waiting.task
+        assert session.started == ["first"]
+
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+import threading
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from inference.engine import EngineOverloadedError
+from prompt.history import Turn, USER, ASSISTANT
+
+# Session fields compared between a live session and its replay
+TURN_STATE_KEYS = ("mode", "is_interview_mode", "interview_state", "questions_asked", "summary_points")
+
+JOB_DESCRIPTION = "Senior Python developer with FastAPI, SQL and cloud experience."
+
+def start_session(app, *turns):
+    session_id = str(uuid.uuid4())
+    for user_input in (JOB_DESCRIPTION, *turns):
+        app.prompt_model_static(session_id, user_input)
+    return session_id
+
+def history_lines(app, session_id: str):
+    return [str(turn) for turn in app.get_chat_history(session_id)["history"]]
+
+class FullQueue:
+    """Occupies every worker of the engine and fills its queue until it rejects the next job."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.release = threading.Event()
+
+    def __enter__(self):
+        running = threading.Semaphore(0)
+
+        def block(model):
+            running.release()
+            self.release.wait()
+
+        for _ in self.engine.workers:
+            self.engine.submit(block, priority="interview")
+        for _ in self.engine.workers:
+            running.acquire()
+        while True:
+            try:
+                self.engine.submit(lambda model: None, priority="background")
+            except EngineOverloadedError:
+                return self
+
+    def __exit__(self, *exc):
+        self.release.set()
+        self.engine.jobs.join()
+
+def test_rejected_turn_leaves_nothing_in_the_history(chat_app):
+    session_id = start_session(chat_app, "/training")
+    before = history_lines(chat_app, session_id)
+    with FullQueue(chat_app.engine):
+        for _ in range(2):
+            with pytest.raises(HTTPException) as rejected:
+                chat_app.prompt_model_static(session_id, "hello")
+            assert rejected.value.status_code == 503
+            assert history_lines(chat_app, session_id) == before
+    chat_app.prompt_model_static(session_id, "hello")
+    assert history_lines(chat_app, session_id)[len(before):][0] == "User: hello"
+    assert len(history_lines(chat_app, session_id)) == len(before) + 2
+
+def test_failed_turn_leaves_nothing_in_the_history(chat_app, monkeypatch):
+    session_id = start_session(chat_app, "/training")
+    before = history_lines(chat_app, session_id)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(chat_app, "run_model", fail)
+    with pytest.raises(HTTPException) as failed:
+        chat_app.prompt_model_static(session_id, "hello")
+    assert failed.value.status_code == 500
+    assert history_lines(chat_app, session_id) == before
+
+def finish_interview(app, session_id: str):
+    """Answer the interview questions until the last one was answered, return the last response."""
+    for _ in range(app.get_chat_history(session_id)["max_questions"] + 1):
+        response = app.prompt_model_static(session_id, "I split the work into small steps.")["response"]
+        if app.get_chat_history(session_id)["interview_state"] == "finished":
+            return response
+    raise AssertionError("The interview did not finish")
+
+def test_last_answer_is_asked_for_the_summary_json(chat_app, monkeypatch):
+    session_id = start_session(chat_app, "/interview")
+    run_model = chat_app.run_model
+    calls = []
+
+    def record(session_id, prompt, max_tokens, *args, profile=None, **kwargs):
+        calls.append((prompt, max_tokens, profile.name))
+        return run_model(session_id, prompt, max_tokens, *args, profile=profile, **kwargs)
+
+    monkeypatch.setattr(chat_app, "run_model", record)
+    response = finish_interview(chat_app, session_id)
+    prompt, max_tokens, profile = calls[-1]
+    assert profile == "interview_summary"
+    assert prompt.endswith(chat_app.LLAMA3_INSTRUCTION.format(chat_app.get_profile(profile).instruction)
+                           + chat_app.LLAMA3_ASSISTANT_HEADER)
+    # The history made room, all of the context left goes to the JSON
+    assert max_tokens == min(chat_app.settings.INTERVIEW_SUMMARY_MAX_TOKENS,
+                             chat_app.settings.LLAMA_N_CTX - chat_app.count_tokens(prompt, add_bos=True))
+    assert prompt.count("I split the work into small steps.") == 1
+    assert "Here is your interview summary:\n```\n- Strength:" in response
+    assert all(chat_app.LLAMA3_INSTRUCTION.format(chat_app.get_profile(profile).instruction) not in prompt
+               for prompt, _, profile in calls[:-1])
+
+def test_last_answer_that_is_not_json_is_returned_filtered(chat_app, monkeypatch):
+    session_id = start_session(chat_app, "/interview")
+    run_model = chat_app.run_model
+    invalid = chat_app.GENERATION_ERRORS.labels("interview", "invalid_output")
+    before = invalid._value.get()
+
+    def free_text(session_id, prompt, max_tokens, *args, profile=None, **kwargs):
+        if profile.name == "interview_summary":
+            return {"choices": [{"text": "Good structure in your answer.\nCandidate: I would add more detail."}]}
+        return run_model(session_id, prompt, max_tokens, *args, profile=profile, **kwargs)
+
+    monkeypatch.setattr(chat_app, "run_model", free_text)
+    assert finish_interview(chat_app, session_id) == "Good structure in your answer."
+    assert invalid._value.get() == before + 1
+    assert chat_app.get_chat_history(session_id)["summary_points"] == [chat_app.NO_SUMMARY]
+
+def stored_conversation(app, *turns):
+    """Run the turns in a new session, return it and the (sender, message) rows save_turn would store."""
+    session_id, messages = str(uuid.uuid4()), []
+    for user_input in (JOB_DESCRIPTION, *turns):
+        messages += [("user", user_input), ("ai", app.prompt_model_static(session_id, user_input)["response"])]
+    return session_id, messages
+
+def replayed_state(session):
+    return ([str(turn) for turn in session["history"]],
+            {key: session[key] for key in ("turn_count", *TURN_STATE_KEYS)})
+
+def test_replayed_session_matches_the_live_one(chat_app):
+    session_id, messages = stored_conversation(chat_app, "/interview", "I wrote the tests first.", "I asked the team.")
+    replayed = chat_app.replay_session(JOB_DESCRIPTION, messages)
+    assert replayed_state(replayed) == replayed_state(chat_app.get_chat_history(session_id))
+    assert replayed["turn_count"] == 4
+
+def test_replay_skips_a_turn_whose_answer_is_missing(chat_app):
+    _, messages = stored_conversation(chat_app, "/training", "What is a REST API?", "And GraphQL?")
+    # The answer to the second question was never saved
+    del messages[5]
+    replayed = chat_app.replay_session(JOB_DESCRIPTION, messages)
+    history = replayed["history"]
+    assert Turn(USER, "What is a REST API?") not in history
+    for (_, user_input), (_, ai_response) in (messages[2:4], messages[5:7]):
+        assert history[history.index(Turn(USER, user_input)) + 1] == Turn(ASSISTANT, ai_response)
+    assert replayed["turn_count"] == 3
+
+def test_replay_skips_an_answer_without_its_user_message(chat_app):
+    _, messages = stored_conversation(chat_app, "/training", "What is a REST API?")
+    replayed = chat_app.replay_session(JOB_DESCRIPTION, messages[1:])
+    assert replayed["turn_count"] == 2
+    assert replayed["history"][0] == Turn(USER, "/training")
@@ -0,0 +1,155 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from prompt.history import Turn, USER, ASSISTANT
+from session_store import SessionLoadError, SessionStore, SqliteSessionStore, VersionConflict, estimate_size
+
+def new_session():
+    return {"history": [], "mode": None, "compacting": None}
+
+def make_store(load=None):
+    return SqliteSessionStore(":memory:", new_session, 0, load=load)
+
+def test_get_creates_a_session_and_every_get_is_a_copy():
+    store = make_store()
+    first = store.get("a")
+    assert first["history"] == [] and first["version"] == 1
+    first["mode"] = "quiz"
+    assert store.get("a")["mode"] is None
+    assert "a" in store
+
+def test_commit_stores_turns_and_drops_transient_keys():
+    store = make_store()
+    session = store.get("a")
+    session["history"].append(Turn(USER, "Hello", tokens=7))
+    session["history"].append(Turn(ASSISTANT, "Hi"))
+    session["prompt_buffer"] = object()
+    store.commit("a", session)
+    assert session["version"] == 2
+    stored = store.get("a")
+    assert stored["history"] == [Turn(USER, "Hello"), Turn(ASSISTANT, "Hi")]
+    assert stored["history"][0].tokens == 7
+    assert "prompt_buffer" not in stored
+    assert stored["version"] == 2
+
+def test_commit_of_a_stale_copy_is_a_conflict():
+    store = make_store()
+    first, second = store.get("a"), store.get("a")
+    first["mode"] = "quiz"
+    store.commit("a", first)
+    second["mode"] = "training"
+    with pytest.raises(VersionConflict):
+        store.commit("a", second)
+    assert store.get("a")["mode"] == "quiz"
+
+def test_update_applies_the_change_to_the_latest_state():
+    store = make_store()
+    stale = store.get("a")
+    calls = []
+
+    def change(session):
+        calls.append(session["version"])
+        if len(calls) == 1:
+            # Another request commits while the change is applied
+            stale["mode"] = "quiz"
+            store.commit("a", stale)
+        session["compacting"] = 1.0
+
+    assert store.update("a", change)
+    assert calls == [1, 2]
+    latest = store.get("a")
+    assert latest["mode"] == "quiz" and latest["compacting"] == 1.0 and latest["version"] == 3
+
+def test_update_can_leave_the_session_as_it_is():
+    store = make_store()
+    store.get("a")
+    assert not store.update("a", lambda session: False)
+    assert store.get("a")["version"] == 1
+
+def test_missing_session_is_loaded_once():
+    loads = []
+
+    def load(session_id):
+        loads.append(session_id)
+        return {"history": [Turn(USER, "stored")], "mode": "interview", "compacting": None}
+
+    store = make_store(load)
+    assert store.get("a")["mode"] == "interview"
+    assert store.get("a")["history"] == [Turn(USER, "stored")]
+    assert loads == ["a"]
+
+def test_failed_load_stores_nothing():
+    def load(session_id):
+        raise ConnectionError("database down")
+
+    store = make_store(load)
+    with pytest.raises(SessionLoadError):
+        store.get("a")
+    assert "a" not in store
+    store.load = lambda session_id: None
+    assert store.get("a")["history"] == []
+
+def test_pop_and_put():
+    store = make_store()
+    session = store.get("a")
+    session["mode"] = "quiz"
+    store["a"] = session
+    assert store.get("a")["mode"] == "quiz"
+    assert store.pop("a")["mode"] == "quiz"
+    assert "a" not in store
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_memory_store(max_sessions=10, max_bytes=10 ** 9, idle_ttl_seconds=0, clock=None):
+    evicted = []
+    store = SessionStore(new_session, max_sessions, max_bytes, idle_ttl_seconds, on_evict=evicted.append, clock=clock or Clock())
+    return store, evicted
+
+def evictions(reason):
+    return REGISTRY.get_sample_value("interview_coach_session_evictions_total", {"reason": reason}) or 0
+
+def test_least_recently_used_session_is_evicted_past_max_sessions():
+    store, evicted = make_memory_store(max_sessions=2)
+    before = evictions("count")
+    store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")
+    assert evicted == ["b"]
+    assert "a" in store and "c" in store and len(store) == 2
+    assert evictions("count") == before + 1
+    assert REGISTRY.get_sample_value("interview_coach_sessions") == 2
+
+def test_sessions_are_evicted_past_max_bytes_except_the_last_used():
+    size = estimate_size(new_session())
+    store, evicted = make_memory_store(max_bytes=2 * size)
+    before = evictions("memory")
+    store.get("a")
+    store.get("b")
+    session = store.get("b")
+    session["history"].append(Turn(USER, "x" * size))
+    store.commit("b", session)
+    assert evicted == ["a"]
+    assert store.stats()["bytes"] == estimate_size(session) > store.max_bytes
+    assert evictions("memory") == before + 1
+    assert REGISTRY.get_sample_value("interview_coach_session_bytes") == store.size_bytes
+
+def test_sessions_idle_past_the_ttl_are_dropped():
+    clock = Clock()
+    store, evicted = make_memory_store(idle_ttl_seconds=60, clock=clock)
+    before = evictions("idle")
+    store.get("a")
+    clock.now += 30
+    store.get("b")
+    clock.now += 40
+    store.get("b")
+    assert evicted == ["a"] and "b" in store
+    clock.now += 61
+    store.get("c")
+    assert evicted == ["a", "b"] and len(store) == 1
+    assert evictions("idle") == before + 2